@@ -0,0 +1,91 @@
+"""
+Recall@k, query latency and size of compressed / quantized FAISS indexes against
+the exact flat index.
+
+Every factory is trained on the vectors of the publication index in
+settings.embedding_folder_path (or on random unit vectors with --synthetic) and
+queried with a sample of the indexed vectors plus a little noise; recall@k is the
+share of the flat index's top k found in the candidate's top k. Index bytes are
+the serialized size, as written to index.faiss.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/faiss_index_benchmark.py -k 20 --factories "IVF1024,Flat;IVF1024,PQ64;HNSW32;SQ8;SQfp16"
+"""
+import time
+import optparse
+
+import faiss
+import numpy as np
+
+from settings import settings
+from cores.index_functions import apply_search_parameters, get_publication_index, train_faiss_index
+
+
+def _flat_index(options) -> faiss.Index:
+    if options.synthetic:
+        vectors = np.random.default_rng(0).standard_normal((options.synthetic, options.dimension)).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        index = faiss.IndexFlatL2(options.dimension)
+        index.add(vectors)
+        return index
+    source = get_publication_index().get().index
+    return train_faiss_index(source, "Flat", max_training_points=source.ntotal)
+
+
+def _queries(flat: faiss.Index, n_queries: int) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    ids = np.sort(rng.choice(flat.ntotal, min(n_queries, flat.ntotal), replace=False))
+    queries = flat.reconstruct_batch(ids)
+    queries += rng.standard_normal(queries.shape).astype(np.float32) * 0.01
+    return queries
+
+
+def _search(index: faiss.Index, queries: np.ndarray, top_k: int):
+    start = time.perf_counter()
+    indices = np.vstack([index.search(query[None, :], top_k)[1] for query in queries])
+    return indices, (time.perf_counter() - start) / len(queries)
+
+
+def _recall(indices: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(found) & set(expected)) / len(expected) for found, expected in zip(indices, truth)]))
+
+
+def main():
+    option_parser = optparse.OptionParser()
+    option_parser.add_option("-f", "--factories", dest="factories", default="IVF1024,Flat;IVF1024,PQ64;HNSW32;SQ8;SQfp16",
+                             help="';'-separated faiss.index_factory strings")
+    option_parser.add_option("-k", "--top-k", dest="top_k", type="int", default=20)
+    option_parser.add_option("-q", "--queries", dest="queries", type="int", default=200)
+    option_parser.add_option("--nprobe", dest="nprobe", type="int", default=settings.publication_index_nprobe)
+    option_parser.add_option("--ef-search", dest="ef_search", type="int", default=settings.publication_index_ef_search)
+    option_parser.add_option("--synthetic", dest="synthetic", type="int", default=0,
+                             help="benchmark on this many random vectors instead of the publication index")
+    option_parser.add_option("--dimension", dest="dimension", type="int", default=1536)
+    options, _ = option_parser.parse_args()
+
+    flat = _flat_index(options)
+    queries = _queries(flat, options.queries)
+    truth, flat_seconds = _search(flat, queries, options.top_k)
+
+    print(f"vectors: {flat.ntotal}, dimension: {flat.d}, queries: {len(queries)}, k: {options.top_k}, "
+          f"nprobe: {options.nprobe}, efSearch: {options.ef_search}")
+    print(f"{'factory':<16} {f'recall@{options.top_k}':>10} {'ms/query':>10} {'MB':>10} {'train s':>10}")
+    print(f"{'Flat':<16} {1.0:>10.3f} {flat_seconds * 1000:>10.3f} {faiss.serialize_index(flat).nbytes / 2**20:>10.1f} {0.0:>10.2f}")
+
+    for index_factory in filter(None, (factory.strip() for factory in options.factories.split(";"))):
+        start = time.perf_counter()
+        try:
+            index = train_faiss_index(flat, index_factory, max_training_points=settings.publication_index_max_training_points)
+        except RuntimeError as e:
+            print(f"{index_factory:<16} could not build: {str(e).splitlines()[-1]}")
+            continue
+        train_seconds = time.perf_counter() - start
+
+        apply_search_parameters(index, options.nprobe, options.ef_search)
+        indices, seconds = _search(index, queries, options.top_k)
+        print(f"{index_factory:<16} {_recall(indices, truth):>10.3f} {seconds * 1000:>10.3f} "
+              f"{faiss.serialize_index(index).nbytes / 2**20:>10.1f} {train_seconds:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Recall@k and latency of dense, BM25 and hybrid publication retrieval.
+
+The labeled sample is a JSON Lines file with one query per line:
+    {"query": "USDIDR NDF 3M", "relevant": ["<publication hash or publication_id>", ...]}
+Without --labels, a sample is derived from the indexed publications, using each
+publication's extracted keywords as the query and the publication itself as the
+only relevant result. Dense and hybrid need Azure OpenAI embeddings credentials.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/hybrid_retrieval_benchmark.py --labels data/retrieval_labels.jsonl -k 20
+"""
+import json
+import time
+import optparse
+
+import numpy as np
+
+from settings import settings
+from cores.index_functions import get_publication_index
+from cores.publication_functions import load_publications, publication_key
+from cores.recsys_functions import _dense_search, merge_hybrid_hits
+
+
+def _load_labels(labels_path: str, limit: int) -> list:
+    if labels_path:
+        with open(labels_path, encoding="utf-8") as labels_file:
+            labels = [json.loads(line) for line in labels_file if line.strip()]
+        return labels[:limit]
+
+    pub_df = load_publications(settings.publication_file_path).head(limit)
+    return [{"query": row.get("llm_extract_keywords") or row.get("title", ""), "relevant": [publication_key(row)]}
+            for row in pub_df.to_dict(orient="records")]
+
+
+def _recall(retrieved_keys: list, relevant: list) -> float:
+    relevant = set(relevant)
+    return len(relevant & set(retrieved_keys)) / len(relevant) if relevant else 0.0
+
+
+def main():
+    option_parser = optparse.OptionParser()
+    option_parser.add_option("-l", "--labels", dest="labels", default="")
+    option_parser.add_option("-n", "--limit", dest="limit", type="int", default=200)
+    option_parser.add_option("-k", "--top-k", dest="top_k", type="int", default=20)
+    options, _ = option_parser.parse_args()
+
+    labels = _load_labels(options.labels, options.limit)
+    queries = [label["query"] for label in labels]
+
+    publication_index = get_publication_index()
+    vectorstore = publication_index.get()
+    bm25 = publication_index.bm25()
+
+    def _keys(hits):
+        return [publication_key(vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).metadata) for i, _ in hits]
+
+    start = time.perf_counter()
+    query_matrix = np.asarray(publication_index.embeddings.embed_documents(queries), dtype=np.float32)
+    embed_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dense_hits = _dense_search(vectorstore, query_matrix, options.top_k)
+    dense_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bm25_hits = [bm25.search(query, options.top_k) for query in queries]
+    bm25_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hybrid_hits = [merge_hybrid_hits(dense, sparse, options.top_k,
+                                     dense_weight=settings.hybrid_dense_weight,
+                                     bm25_weight=settings.hybrid_bm25_weight)
+                   for dense, sparse in zip(dense_hits, bm25_hits)]
+    hybrid_seconds = dense_seconds + bm25_seconds + time.perf_counter() - start
+
+    print(f"queries: {len(queries)}, chunks: {len(bm25)}, k: {options.top_k}, "
+          f"weights: dense {settings.hybrid_dense_weight} / bm25 {settings.hybrid_bm25_weight}")
+    print(f"query embedding: {embed_seconds / max(len(queries), 1) * 1000:.2f} ms/query (shared by dense and hybrid)")
+    print(f"{'retriever':<10} {f'recall@{options.top_k}':>10} {'ms/query':>10}")
+    for name, hits, seconds in (("dense", dense_hits, dense_seconds),
+                                ("bm25", bm25_hits, bm25_seconds),
+                                ("hybrid", hybrid_hits, hybrid_seconds)):
+        recall = np.mean([_recall(_keys(query_hits), label["relevant"]) for query_hits, label in zip(hits, labels)])
+        print(f"{name:<10} {recall:>10.3f} {seconds / max(len(queries), 1) * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
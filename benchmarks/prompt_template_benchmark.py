@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of prompt rendering cost per call, before and after the compiled template cache.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/prompt_template_benchmark.py
+"""
+import time
+
+from langchain.prompts import PromptTemplate
+
+from prompts.chat import generate_chat_summary_prompt
+from prompts.publication import generate_keywords_prompt
+from prompts.recsys import get_currency_relevance_prompt, get_passage_precision_prompt
+from cores.prompt_functions import format_prompt, get_prompt_cache_stats, clear_prompt_cache
+
+
+ITERATIONS = 2000
+
+PROMPT_INPUTS = {
+    "client_chat_currencies": "USD; IDR",
+    "client_chat_interest": "Hedging USD/IDR exposure with NDFs",
+    "client_chat_products": "NDF; FX forward",
+    "candidate_title": "IDR outlook",
+    "candidate_summary": "Rupiah under pressure as the Fed stays on hold.",
+    "candidate_currencies": "USD; IDR",
+    "candidate_topics": "FX; EM Asia",
+    "candidate_keywords": "rupiah; NDF; Bank Indonesia",
+    "passage_text": "We recommend buying 3M USD/IDR NDF as a hedge.",
+    "chat_history": "Morning, looking at USD/IDR NDF 3M levels.",
+    "article_content": "Bank Indonesia intervened in the spot and NDF markets.",
+}
+
+TEMPLATES = {
+    "get_currency_relevance_prompt": get_currency_relevance_prompt(),
+    "get_passage_precision_prompt": get_passage_precision_prompt(),
+    "generate_chat_summary_prompt": generate_chat_summary_prompt(),
+    "generate_keywords_prompt": generate_keywords_prompt(),
+}
+
+
+def _render_uncached(prompt_template: str):
+    prompt = PromptTemplate.from_template(prompt_template, template_format="jinja2")
+    return prompt.invoke(PROMPT_INPUTS)
+
+
+def _render_cached(prompt_template: str):
+    return format_prompt(prompt_template, PROMPT_INPUTS, "jinja2")
+
+
+def _time_per_call_us(render, prompt_template: str) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        render(prompt_template)
+    return (time.perf_counter() - start) / ITERATIONS * 1e6
+
+
+def main():
+    clear_prompt_cache()
+
+    print(f"{'prompt':<32} {'before (us)':>12} {'after (us)':>12} {'speedup':>8}")
+    for name, prompt_template in TEMPLATES.items():
+        assert _render_uncached(prompt_template).to_string() == _render_cached(prompt_template).to_string()
+
+        before = _time_per_call_us(_render_uncached, prompt_template)
+        after = _time_per_call_us(_render_cached, prompt_template)
+        print(f"{name:<32} {before:>12.1f} {after:>12.1f} {before / after:>7.1f}x")
+
+    print(f"compile cache: {get_prompt_cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
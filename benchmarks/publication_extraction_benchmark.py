@@ -0,0 +1,94 @@
+"""
+Compare the four-call and the combined single-call publication feature extraction.
+
+Reports wall time, prompt/completion tokens (tiktoken estimate of what is sent
+and returned) and per-field agreement (Jaccard of the extracted items) on a sample
+of settings.publication_file_path. Needs Azure OpenAI credentials.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/publication_extraction_benchmark.py --limit 20
+"""
+import json
+import time
+import optparse
+from functools import lru_cache
+
+import tiktoken
+
+from settings import settings
+from cores.prompt_functions import format_prompt
+from cores.publication_functions import (PUBLICATION_EXTRACTORS,
+                                         load_publications,
+                                         publication_feature_extraction)
+from prompts.publication import generate_publication_metadata_prompt
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    return tiktoken.get_encoding("o200k_base")
+
+
+def _count_tokens(text: str) -> int:
+    return len(_encoding().encode(text or ""))
+
+
+def _items(value: str) -> set:
+    return {item.strip().lower() for item in (value or "").split(";") if item.strip()}
+
+
+def _jaccard(a: str, b: str) -> float:
+    a, b = _items(a), _items(b)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _token_usage(pub_df, mode: str) -> tuple:
+    prompt_tokens, completion_tokens = 0, 0
+    for row in pub_df.to_dict(orient="records"):
+        prompt_inputs = {"article_content": row["clean_content"]}
+        if mode == "combined":
+            prompt_tokens += _count_tokens(format_prompt(generate_publication_metadata_prompt(), prompt_inputs).to_string())
+            completion_tokens += _count_tokens(json.dumps({column.removeprefix("llm_extract_"): sorted(_items(row[column]))
+                                                           for column, _ in PUBLICATION_EXTRACTORS}))
+        else:
+            for column, prompt_function in PUBLICATION_EXTRACTORS:
+                prompt_tokens += _count_tokens(format_prompt(prompt_function(), prompt_inputs).to_string())
+                completion_tokens += _count_tokens(row[column])
+    return prompt_tokens, completion_tokens
+
+
+def _run(pub_df, mode: str):
+    start = time.perf_counter()
+    result_df = publication_feature_extraction(pub_df.copy(), checkpoint_path="", mode=mode)
+    return result_df, time.perf_counter() - start
+
+
+def main():
+    option_parser = optparse.OptionParser()
+    option_parser.add_option("-n", "--limit", dest="limit", type="int", default=20)
+    options, _ = option_parser.parse_args()
+
+    # measure real calls, not cached responses
+    settings.llm_cache_enabled = False
+
+    pub_df = load_publications(settings.publication_file_path).head(options.limit)
+
+    separate_df, separate_seconds = _run(pub_df, "separate")
+    combined_df, combined_seconds = _run(pub_df, "combined")
+
+    print(f"publications: {len(pub_df)}")
+    print(f"{'mode':<10} {'LLM calls':>10} {'seconds':>10} {'prompt tok':>12} {'output tok':>12}")
+    for mode, result_df, seconds, n_calls in (("separate", separate_df, separate_seconds, len(pub_df) * len(PUBLICATION_EXTRACTORS)),
+                                              ("combined", combined_df, combined_seconds, len(pub_df))):
+        prompt_tokens, completion_tokens = _token_usage(result_df, mode)
+        print(f"{mode:<10} {n_calls:>10} {seconds:>10.2f} {prompt_tokens:>12} {completion_tokens:>12}")
+
+    print("field agreement (mean Jaccard, combined vs separate)")
+    for column, _ in PUBLICATION_EXTRACTORS:
+        scores = [_jaccard(a, b) for a, b in zip(separate_df[column], combined_df[column])]
+        print(f"  {column:<26} {sum(scores) / max(len(scores), 1):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import json
+import sqlite3
+import threading
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+from settings import settings
+from custom_types import ClientInput
+
+
+def archive_date(value) -> str:
+    """ISO date of a recommendation date such as 20250822 or "2025-08-22" """
+    return pd.Timestamp(str(value)).date().isoformat()
+
+
+def archive_client_id(client: ClientInput) -> str:
+    """Archive key of a client: its sorted client_ids, or its company name when it has none"""
+    client_ids = sorted({str(client_id).strip() for client_id in client.client_ids or [] if client_id and str(client_id).strip()})
+    return ",".join(client_ids) if client_ids else f"company:{client.company}"
+
+
+class RecommendationArchive:
+    """
+    Per-client SQLite archive of the publications scored for and recommended to
+    each client, keyed by (client_id, publication hash); client_id is the
+    archive_client_id of the ClientInput.
+
+    A row keeps the latest precision_best_passage with the date it was scored,
+    and the date the publication was last recommended, so a later run can drop
+    what was already sent and skip or reuse the precision scores it paid for.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS client_publications (
+                client_id        TEXT NOT NULL,
+                hash             TEXT NOT NULL,
+                precision        TEXT,
+                scored_date      TEXT,
+                recommended_date TEXT,
+                PRIMARY KEY (client_id, hash)
+            )
+        """)
+        self._connection.commit()
+
+    def recent(self, client_id: str, end_date, day_range: int) -> Dict[str, dict]:
+        """
+        Entries of `client_id` scored or recommended in the `day_range` days up to
+        and including `end_date`, by publication hash. Dates outside the window
+        are returned as None.
+        """
+        end = archive_date(end_date)
+        start = (pd.Timestamp(end) - pd.Timedelta(days=day_range - 1)).date().isoformat()
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT hash, precision, scored_date, recommended_date FROM client_publications "
+                "WHERE client_id = ? AND (scored_date BETWEEN ? AND ? OR recommended_date BETWEEN ? AND ?)",
+                (client_id, start, end, start, end),
+            ).fetchall()
+
+        entries = {}
+        for publication_hash, precision, scored_date, recommended_date in rows:
+            scored = scored_date is not None and start <= scored_date <= end
+            entries[publication_hash] = {
+                "precision_best_passage": json.loads(precision) if scored and precision else None,
+                "scored_date": scored_date if scored else None,
+                "recommended_date": recommended_date if recommended_date is not None and start <= recommended_date <= end else None,
+            }
+        return entries
+
+    def record_scores(self, client_id: str, scores: List[Tuple[str, dict]], date):
+        """Store the (hash, precision_best_passage) pairs scored for `client_id` on `date`"""
+        if not scores:
+            return
+        scored_date = archive_date(date)
+        with self._lock:
+            self._connection.executemany(
+                "INSERT INTO client_publications (client_id, hash, precision, scored_date) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (client_id, hash) DO UPDATE SET precision = excluded.precision, scored_date = excluded.scored_date",
+                [(client_id, publication_hash, json.dumps(precision, ensure_ascii=False, default=str), scored_date)
+                 for publication_hash, precision in scores],
+            )
+            self._connection.commit()
+
+    def record_recommended(self, client_id: str, hashes: List[str], date):
+        """Mark the publications sent to `client_id` on `date`"""
+        if not hashes:
+            return
+        recommended_date = archive_date(date)
+        with self._lock:
+            self._connection.executemany(
+                "INSERT INTO client_publications (client_id, hash, recommended_date) VALUES (?, ?, ?) "
+                "ON CONFLICT (client_id, hash) DO UPDATE SET recommended_date = excluded.recommended_date",
+                [(client_id, publication_hash, recommended_date) for publication_hash in dict.fromkeys(hashes)],
+            )
+            self._connection.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM client_publications").fetchone()[0]
+
+
+_RECOMMENDATION_ARCHIVE: Optional[RecommendationArchive] = None
+_RECOMMENDATION_ARCHIVE_LOCK = threading.Lock()
+
+
+def get_recommendation_archive() -> Optional[RecommendationArchive]:
+    """Process-wide RecommendationArchive, None when settings.recommendation_archive_mode is "off" """
+    global _RECOMMENDATION_ARCHIVE
+    if settings.recommendation_archive_mode == "off":
+        return None
+    if _RECOMMENDATION_ARCHIVE is None:
+        with _RECOMMENDATION_ARCHIVE_LOCK:
+            if _RECOMMENDATION_ARCHIVE is None:
+                _RECOMMENDATION_ARCHIVE = RecommendationArchive(settings.recommendation_archive_path)
+    return _RECOMMENDATION_ARCHIVE
@@ -0,0 +1,185 @@
+import os
+import re
+import numpy as np
+from collections import Counter
+from typing import List, Optional, Tuple
+
+
+BM25_FILE_NAME = "bm25.npz"
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[/\-.][a-z0-9]+)*")
+_TOKEN_SEPARATORS = re.compile(r"[/\-.]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased alphanumeric tokens. Compound tokens such as "USD/IDR" or
+    "EUR-USD" are indexed both as their parts and joined ("usdidr").
+    """
+    tokens = []
+    for token in _TOKEN_PATTERN.findall((text or "").lower()):
+        parts = _TOKEN_SEPARATORS.split(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+            tokens.append("".join(parts))
+        else:
+            tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over the chunks of a FAISS vectorstore.
+
+    Row i is the chunk at FAISS position i, so hits map back through
+    index_to_docstore_id. Postings are stored as CSR-style numpy arrays
+    (offsets into concatenated doc ids / term frequencies per term) and
+    persisted with np.savez next to the FAISS files.
+    """
+
+    def __init__(self,
+                 terms: np.ndarray,
+                 offsets: np.ndarray,
+                 doc_ids: np.ndarray,
+                 term_frequencies: np.ndarray,
+                 doc_lengths: np.ndarray,
+                 docstore_ids: np.ndarray,
+                 k1: float = 1.5,
+                 b: float = 0.75):
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_frequencies = term_frequencies
+        self.doc_lengths = doc_lengths
+        self.docstore_ids = docstore_ids
+        self.k1 = k1
+        self.b = b
+
+        self._vocabulary = {term: i for i, term in enumerate(terms.tolist())}
+        n_docs = len(doc_lengths)
+        document_frequencies = np.diff(offsets).astype(np.float32)
+        self._idf = np.log1p((n_docs - document_frequencies + 0.5) / (document_frequencies + 0.5)).astype(np.float32)
+        average_length = float(doc_lengths.mean()) if n_docs else 0.0
+        self._length_norm = (k1 * (1 - b + b * doc_lengths / average_length)).astype(np.float32) if n_docs else doc_lengths
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    @staticmethod
+    def _count_tokens(texts: List[str], vocabulary: dict, first_doc: int):
+        term_ids, doc_ids, term_frequencies, doc_lengths = [], [], [], []
+        for doc_id, text in enumerate(texts, start=first_doc):
+            counts = Counter(tokenize(text))
+            doc_lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc_id)
+                term_frequencies.append(count)
+        return (np.asarray(term_ids, dtype=np.int64),
+                np.asarray(doc_ids, dtype=np.int32),
+                np.asarray(term_frequencies, dtype=np.float32),
+                np.asarray(doc_lengths, dtype=np.float32))
+
+    @classmethod
+    def _from_postings(cls, vocabulary: dict, term_ids, doc_ids, term_frequencies, doc_lengths, docstore_ids) -> "BM25Index":
+        order = np.lexsort((doc_ids, term_ids))
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=offsets[1:])
+        return cls(terms=np.array(list(vocabulary), dtype=str),
+                   offsets=offsets,
+                   doc_ids=doc_ids[order],
+                   term_frequencies=term_frequencies[order],
+                   doc_lengths=doc_lengths,
+                   docstore_ids=np.asarray(docstore_ids, dtype=str))
+
+    @classmethod
+    def from_texts(cls, texts: List[str], docstore_ids: List[str]) -> "BM25Index":
+        vocabulary = {}
+        postings = cls._count_tokens(texts, vocabulary, first_doc=0)
+        return cls._from_postings(vocabulary, *postings, docstore_ids)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore) -> "BM25Index":
+        docstore_ids = [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)]
+        texts = [vectorstore.docstore.search(docstore_id).page_content for docstore_id in docstore_ids]
+        return cls.from_texts(texts, docstore_ids)
+
+    def extend(self, texts: List[str], docstore_ids: List[str]) -> "BM25Index":
+        """New index with `texts` appended as the next rows; only the new texts are tokenized"""
+        vocabulary = dict(self._vocabulary)
+        old_term_ids = np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(self.offsets))
+        term_ids, doc_ids, term_frequencies, doc_lengths = self._count_tokens(texts, vocabulary, first_doc=len(self))
+        return self._from_postings(vocabulary,
+                                   np.concatenate([old_term_ids, term_ids]),
+                                   np.concatenate([self.doc_ids, doc_ids]),
+                                   np.concatenate([self.term_frequencies, term_frequencies]),
+                                   np.concatenate([self.doc_lengths, doc_lengths]),
+                                   np.concatenate([self.docstore_ids, np.asarray(docstore_ids, dtype=str)]))
+
+    def extend_from_vectorstore(self, vectorstore) -> "BM25Index":
+        """Index the chunks the vectorstore gained since this index was built"""
+        docstore_ids = [vectorstore.index_to_docstore_id[i] for i in range(len(self), vectorstore.index.ntotal)]
+        texts = [vectorstore.docstore.search(docstore_id).page_content for docstore_id in docstore_ids]
+        return self.extend(texts, docstore_ids)
+
+    def is_prefix_of(self, vectorstore) -> bool:
+        """Whether every row still is the chunk at the same FAISS position"""
+        n = len(self)
+        if n > vectorstore.index.ntotal:
+            return False
+        return n == 0 or (self.docstore_ids[0] == vectorstore.index_to_docstore_id[0]
+                          and self.docstore_ids[n - 1] == vectorstore.index_to_docstore_id[n - 1])
+
+    def matches(self, vectorstore) -> bool:
+        return len(self) == vectorstore.index.ntotal and self.is_prefix_of(vectorstore)
+
+    def search(self, query: str, top_k: int = 10, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top `top_k` (FAISS position, BM25 score) pairs with a positive score, best first, among the `allowed` positions"""
+        term_ids = [self._vocabulary[token] for token in set(tokenize(query)) if token in self._vocabulary]
+        if not term_ids or not len(self):
+            return []
+
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            doc_ids = self.doc_ids[start:end]
+            term_frequencies = self.term_frequencies[start:end]
+            scores[doc_ids] += self._idf[term_id] * term_frequencies * (self.k1 + 1) / (term_frequencies + self._length_norm[doc_ids])
+
+        if allowed is not None:
+            scores *= allowed
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(i), float(scores[i])) for i in candidates]
+
+    def save(self, folder_path: str):
+        os.makedirs(folder_path, exist_ok=True)
+        path = os.path.join(folder_path, BM25_FILE_NAME)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path,
+                 terms=self.terms,
+                 offsets=self.offsets,
+                 doc_ids=self.doc_ids,
+                 term_frequencies=self.term_frequencies,
+                 doc_lengths=self.doc_lengths,
+                 docstore_ids=self.docstore_ids,
+                 params=np.array([self.k1, self.b]))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, folder_path: str) -> Optional["BM25Index"]:
+        path = os.path.join(folder_path, BM25_FILE_NAME)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            k1, b = data["params"].tolist()
+            return cls(terms=data["terms"],
+                       offsets=data["offsets"],
+                       doc_ids=data["doc_ids"],
+                       term_frequencies=data["term_frequencies"],
+                       doc_lengths=data["doc_lengths"],
+                       docstore_ids=data["docstore_ids"],
+                       k1=k1,
+                       b=b)
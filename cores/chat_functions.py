@@ -1,31 +1,316 @@
+import os
+import asyncio
+import threading
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pa_dataset
+import pyarrow.fs as pa_fs
 from loguru import logger
 from functools import partial
+from typing import List, Optional
 from concurrent.futures import ThreadPoolExecutor
 
-from langchain.schema import Document
-from langchain_community.vectorstores import FAISS
-from langchain_openai import AzureOpenAIEmbeddings
-
 from prompts.chat import *
 from settings import settings
-from cores.llm_functions import call_llm
+from cores.llm_functions import call_llm, acall_llm, llm_concurrency_limiter
+from cores.index_functions import get_chat_embedding_index
 
 
-def chat_feature_extraction(client_profile: dict, chat_history_df: pd.DataFrame):
+CHAT_RETRIEVER_K = 20
+CHAT_RETRIEVER_SCORE_THRESHOLD = 0.5
 
-    chat_history = chat_history_df.to_dict(orient="records")
 
-    chat_text = "\n\n".join([str(item.get("chat", "")) for item in chat_history])
-    call_llm_client_template = partial(call_llm, prompt_inputs={"chat_history": chat_text}, template_type="jinja2")
+def _normalize_name(name) -> str:
+    return str(name).strip().lower()
+
+
+def _coverage_window(end_date=None, day_range: Optional[int] = None):
+    """[start, end) of the `day_range` days up to and including `end_date`, as naive UTC timestamps"""
+    end = pd.Timestamp(str(end_date)).normalize() + pd.Timedelta(days=1) if end_date else None
+    start = end - pd.Timedelta(days=day_range) if end is not None and day_range else None
+    return start, end
+
+
+def _parse_chat_datetimes(datetimes: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(datetimes):
+        return datetimes.dt.tz_localize("UTC") if datetimes.dt.tz is None else datetimes
+    # Bloomberg exports "YYYY-MM-DD HH:MM:SS UTC"; stripping the suffix keeps the fast ISO8601 parser
+    return pd.to_datetime(datetimes.astype(str).str.removesuffix(" UTC"), format="ISO8601", utc=True, errors="coerce")
+
+
+class ChatStore:
+    """
+    Bloomberg chat history parsed once per run and indexed for per-client slicing.
+
+    Messages are sorted by (room_id, datetimeutc) and rooms are indexed by the
+    company_name and name of their participants, so a client's windowed slice is
+    a few dictionary lookups and binary searches instead of a full scan.
+    """
+
+    def __init__(self, chat_df: pd.DataFrame):
+        chat_df = chat_df.copy()
+        chat_df["datetimeutc"] = _parse_chat_datetimes(chat_df["datetimeutc"])
+        chat_df = chat_df.sort_values(["room_id", "datetimeutc"], kind="stable").reset_index(drop=True)
+
+        self._df = chat_df
+        self._timestamps = chat_df["datetimeutc"].dt.tz_convert(None).to_numpy(dtype="datetime64[ns]")
+
+        room_ids = chat_df["room_id"].to_numpy()
+        room_starts = np.flatnonzero(np.r_[True, room_ids[1:] != room_ids[:-1]]) if len(room_ids) else np.array([], dtype=int)
+        room_ends = np.r_[room_starts[1:], len(room_ids)] if len(room_ids) else np.array([], dtype=int)
+        self._room_bounds = {room_ids[start]: (start, end) for start, end in zip(room_starts, room_ends)}
+
+        self._rooms_by_company = self._index_rooms(chat_df, "company_name")
+        self._rooms_by_name = self._index_rooms(chat_df, "name")
+
+    @staticmethod
+    def _index_rooms(chat_df: pd.DataFrame, column: str) -> dict:
+        if column not in chat_df.columns:
+            return {}
+        pairs = pd.DataFrame({"key": chat_df[column].astype(str).str.strip().str.lower(),
+                              "room_id": chat_df["room_id"]})
+        pairs = pairs[chat_df[column].notna()].drop_duplicates().sort_values("key", kind="stable")
+
+        keys, room_ids = pairs["key"].to_numpy(), pairs["room_id"].to_numpy()
+        if not len(keys):
+            return {}
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        ends = np.r_[starts[1:], len(keys)]
+        return {keys[start]: set(room_ids[start:end]) for start, end in zip(starts, ends)}
+
+    @classmethod
+    def from_csv(cls, chat_file_path: str) -> "ChatStore":
+        return cls(pd.read_csv(chat_file_path))
+
+    def __len__(self) -> int:
+        return len(self._df)
+
+    def get_client_chats(self,
+                         company_names: List[str],
+                         sales_names: Optional[List[str]] = None,
+                         end_date=None,
+                         day_range: Optional[int] = None) -> pd.DataFrame:
+        """
+        Return the messages of the rooms where one of `company_names` participates
+        (restricted to rooms with one of `sales_names` when given), within the
+        `day_range` days up to and including `end_date`, in chronological order.
+        """
+        rooms = set()
+        for company_name in filter(None, company_names or []):
+            rooms |= self._rooms_by_company.get(_normalize_name(company_name), set())
+
+        sales_names = [name for name in (sales_names or []) if name]
+        if sales_names:
+            sales_rooms = set()
+            for name in sales_names:
+                sales_rooms |= self._rooms_by_name.get(_normalize_name(name), set())
+            rooms &= sales_rooms
+
+        start, end = _coverage_window(end_date, day_range)
+        end = end.to_datetime64() if end is not None else None
+        start = start.to_datetime64() if start is not None else None
+
+        positions = []
+        for room_id in rooms:
+            room_start, room_end = self._room_bounds[room_id]
+            room_timestamps = self._timestamps[room_start:room_end]
+            lo = room_start + (np.searchsorted(room_timestamps, start, side="left") if start is not None else 0)
+            hi = room_start + (np.searchsorted(room_timestamps, end, side="left") if end is not None else len(room_timestamps))
+            if hi > lo:
+                positions.append(np.arange(lo, hi))
+
+        if not positions:
+            return self._df.iloc[0:0]
+
+        positions = np.concatenate(positions)
+        positions = positions[np.argsort(self._timestamps[positions], kind="stable")]
+        return self._df.iloc[positions]
+
+
+CHAT_CATEGORICAL_COLUMNS = ["room_id", "name", "company_name", "type"]
+CHAT_ROWS_PER_GROUP = 4096
+
+
+def ingest_bbg_chat_export(chat_file_path: str, chat_dataset_path: str) -> int:
+    """
+    Convert a Bloomberg chat CSV export into a Parquet dataset partitioned by
+    message date, with rows clustered by company inside each daily file.
+
+    Companies are clustered into small row groups rather than partition
+    directories, which keeps company predicates prunable through row-group
+    statistics without one file per (day, company). Identifier columns are
+    dictionary encoded (pandas categoricals on read) and lower-cased name /
+    company keys are stored for case-insensitive lookups. Only the dates present
+    in the export are rewritten, so daily exports extend a long history.
+
+    Returns:
+        int: Number of messages written
+    """
+    chat_df = pd.read_csv(chat_file_path, dtype={column: "string" for column in CHAT_CATEGORICAL_COLUMNS})
+    chat_df["datetimeutc"] = _parse_chat_datetimes(chat_df["datetimeutc"])
+    chat_df = chat_df.dropna(subset=["datetimeutc"])
+
+    chat_df["date"] = chat_df["datetimeutc"].dt.strftime("%Y-%m-%d")
+    chat_df["company_key"] = chat_df["company_name"].fillna("").str.strip().str.lower()
+    chat_df["name_key"] = chat_df["name"].fillna("").str.strip().str.lower()
+    for column in CHAT_CATEGORICAL_COLUMNS + ["name_key"]:
+        chat_df[column] = chat_df[column].astype("category")
+
+    chat_df = chat_df.sort_values(["date", "company_key", "room_id", "datetimeutc"], kind="stable")
+    table = pa.Table.from_pandas(chat_df, preserve_index=False)
+    pa_dataset.write_dataset(
+        table,
+        chat_dataset_path,
+        format="parquet",
+        partitioning=pa_dataset.partitioning(pa.schema([("date", pa.string())]), flavor="hive"),
+        existing_data_behavior="delete_matching",
+        max_partitions=100_000,
+        min_rows_per_group=CHAT_ROWS_PER_GROUP,
+        max_rows_per_group=CHAT_ROWS_PER_GROUP,
+    )
+    logger.info(f"[ChatStore] Wrote {len(chat_df)} messages from {chat_file_path} to {chat_dataset_path}")
+    return len(chat_df)
+
+
+class ParquetChatStore:
+    """
+    Chat history read from the partitioned Parquet dataset written by ingest_bbg_chat_export.
+
+    Files are memory-mapped and every lookup pushes the date window and the
+    company / room predicates down to the scan, so only the daily partitions of
+    the window and the row groups of the client's company and rooms are read.
+    """
+
+    def __init__(self, chat_dataset_path: str):
+        self.chat_dataset_path = chat_dataset_path
+        self._dataset = pa_dataset.dataset(chat_dataset_path,
+                                           format="parquet",
+                                           partitioning="hive",
+                                           filesystem=pa_fs.LocalFileSystem(use_mmap=True))
+
+    def __len__(self) -> int:
+        return self._dataset.count_rows()
+
+    def _room_ids(self, key_column: str, keys: List[str], window_filter) -> set:
+        keys = [_normalize_name(key) for key in keys if key]
+        if not keys:
+            return set()
+        key_filter = pa_dataset.field(key_column).isin(keys)
+        if window_filter is not None:
+            key_filter = key_filter & window_filter
+        table = self._dataset.to_table(columns=["room_id"], filter=key_filter)
+        return set(table.column("room_id").to_pylist())
+
+    def get_client_chats(self,
+                         company_names: List[str],
+                         sales_names: Optional[List[str]] = None,
+                         end_date=None,
+                         day_range: Optional[int] = None) -> pd.DataFrame:
+        """Same contract as ChatStore.get_client_chats"""
+        start, end = _coverage_window(end_date, day_range)
+
+        window_filter = None
+        if end is not None:
+            window_filter = (pa_dataset.field("date") <= end.strftime("%Y-%m-%d")) & (pa_dataset.field("datetimeutc") < end.tz_localize("UTC"))
+        if start is not None:
+            start_filter = (pa_dataset.field("date") >= start.strftime("%Y-%m-%d")) & (pa_dataset.field("datetimeutc") >= start.tz_localize("UTC"))
+            window_filter = start_filter if window_filter is None else window_filter & start_filter
+
+        rooms = self._room_ids("company_key", company_names or [], window_filter)
+        if sales_names and any(sales_names):
+            rooms &= self._room_ids("name_key", sales_names, window_filter)
+
+        columns = [name for name in self._dataset.schema.names if name not in ("date", "company_key", "name_key")]
+        if not rooms:
+            return self._dataset.schema.empty_table().select(columns).to_pandas()
+
+        room_filter = pa_dataset.field("room_id").isin(sorted(rooms))
+        table = self._dataset.to_table(columns=columns,
+                                       filter=room_filter if window_filter is None else room_filter & window_filter)
+        return table.to_pandas().sort_values("datetimeutc", kind="stable").reset_index(drop=True)
+
+
+_CHAT_STORES: dict = {}
+_CHAT_STORES_LOCK = threading.Lock()
+
+
+def _chat_dataset_is_stale(chat_file_path: str, chat_dataset_path: str) -> bool:
+    if not os.path.exists(chat_dataset_path):
+        return True
+    return os.path.exists(chat_file_path) and os.path.getmtime(chat_file_path) > os.path.getmtime(chat_dataset_path)
+
 
-    prompt_templates = [
+def get_chat_store(chat_file_path: Optional[str] = None):
+    """
+    Process-wide chat store.
+
+    With settings.bbg_chat_dataset_path set, the CSV export is converted to the
+    partitioned Parquet dataset whenever it is newer than the dataset, and chats
+    are read through ParquetChatStore. Otherwise the whole CSV is loaded into ChatStore.
+    """
+    chat_file_path = chat_file_path or settings.bbg_chat_file_path
+    chat_dataset_path = settings.bbg_chat_dataset_path
+
+    with _CHAT_STORES_LOCK:
+        chat_store = _CHAT_STORES.get(chat_file_path)
+        if chat_store is not None:
+            return chat_store
+
+        if chat_dataset_path:
+            if _chat_dataset_is_stale(chat_file_path, chat_dataset_path):
+                ingest_bbg_chat_export(chat_file_path, chat_dataset_path)
+                os.utime(chat_dataset_path)
+            chat_store = ParquetChatStore(chat_dataset_path)
+            logger.info(f"[ChatStore] Opened {chat_dataset_path}")
+        else:
+            chat_store = ChatStore.from_csv(chat_file_path)
+            logger.info(f"[ChatStore] Loaded {len(chat_store)} messages from {chat_file_path}")
+
+        _CHAT_STORES[chat_file_path] = chat_store
+
+    return chat_store
+
+
+def _chat_prompt_templates():
+    return [
         ("chat_summary", generate_chat_summary_prompt()),
         ("chat_interest", generate_chat_interest_prompt()),
         ("chat_products", generate_chat_products_prompt()),
         ("chat_currencies", generate_chat_currencies_prompt()),
     ]
 
+
+def _chat_text(chat_history: list) -> str:
+    return "\n\n".join([str(item.get("chat", item.get("msg", ""))) for item in chat_history])
+
+
+def _chat_retriever_query(client_profile: dict) -> str:
+    return " ".join(filter(None, [client_profile.get("chat_interest", ""), client_profile.get("chat_products", ""), client_profile.get("chat_currencies", "")]))
+
+
+def _attach_chat_history(client_profile: dict, chat_history: list, relevant_chat_documents: list) -> dict:
+    relevant_chats = [doc.metadata.get('chat', doc.metadata.get('msg', '')) for doc in relevant_chat_documents]
+
+    client_profile["chat_history"] = relevant_chats
+    try:
+        original_cols = ["name", "company_name", "msg", "type"]
+        client_profile["original_chat_history"] = [{k: item.get(k, "") for k in original_cols} for item in chat_history]
+    except Exception:
+        client_profile["original_chat_history"] = chat_history
+
+    return client_profile
+
+
+def chat_feature_extraction(client_profile: dict, chat_history_df: pd.DataFrame):
+
+    chat_history = chat_history_df.to_dict(orient="records")
+
+    chat_text = _chat_text(chat_history)
+    call_llm_client_template = partial(call_llm, prompt_inputs={"chat_history": chat_text}, template_type="jinja2")
+
+    prompt_templates = _chat_prompt_templates()
+
     def call_llm_client(prompt_template):
         return call_llm_client_template(prompt_template=prompt_template)
     
@@ -42,36 +327,54 @@ def chat_feature_extraction(client_profile: dict, chat_history_df: pd.DataFrame)
                 logger.error(f"Error calling LLM client for {column_name}: {e}")
                 client_profile[column_name] = ""
 
-    # Initialize Azure OpenAI Embeddings
-    embeddings = AzureOpenAIEmbeddings(
-        azure_endpoint=settings.azure_openai_embeddings_endpoint,
-        azure_deployment=settings.azure_openai_embeddings_deployment_name,
-        openai_api_version=settings.azure_openai_embeddings_api_version,
-        openai_api_key=settings.azure_openai_embeddings_api_key,
-    )
-    chat_history_documents = [Document(page_content=str(chat_item.get("chat", chat_item.get("msg", ""))), metadata=chat_item) for chat_item in chat_history]
+    if not chat_history:
+        logger.warning("No chat history in the coverage window, skipping chat retrieval")
+        return _attach_chat_history(client_profile, chat_history, [])
 
-    vectorstore = FAISS.from_documents(chat_history_documents, embeddings)
+    # Only messages not embedded by a previous run or client are sent to the embeddings API
+    chat_index = get_chat_embedding_index()
+    message_hashes = chat_index.update(chat_history)
 
-    retriever = vectorstore.as_retriever(
-        search_type="similarity_score_threshold",
-        search_kwargs={
-            "k": 20,
-            "fetch_k": 200,
-            "score_threshold": 0.5,
-        }
-    )
+    relevant_chat_documents = chat_index.similarity_search(_chat_retriever_query(client_profile),
+                                                           message_hashes,
+                                                           k=CHAT_RETRIEVER_K,
+                                                           score_threshold=CHAT_RETRIEVER_SCORE_THRESHOLD)
 
-    query = " ".join(filter(None, [client_profile.get("chat_interest", ""), client_profile.get("chat_products", ""), client_profile.get("chat_currencies", "")]))
-    relevant_chat_documents = retriever.invoke(query)
-    relevant_chats = [doc.metadata.get('chat', doc.metadata.get('msg', '')) for doc in relevant_chat_documents]
+    return _attach_chat_history(client_profile, chat_history, relevant_chat_documents)
 
-    client_profile["chat_history"] = relevant_chats
-    try:
-        original_cols = ["name", "company_name", "msg", "type"]
-        client_profile["original_chat_history"] = [{k: item.get(k, "") for k in original_cols} for item in chat_history]
-    except Exception:
-        client_profile["original_chat_history"] = chat_history
 
-    return client_profile
-    
\ No newline at end of file
+async def achat_feature_extraction(client_profile: dict, chat_history_df: pd.DataFrame):
+    """Async variant of chat_feature_extraction built on acall_llm and the async embeddings API"""
+
+    chat_history = chat_history_df.to_dict(orient="records")
+    chat_text = _chat_text(chat_history)
+
+    prompt_templates = _chat_prompt_templates()
+    results = await asyncio.gather(*[acall_llm(prompt_template=prompt_template,
+                                               prompt_inputs={"chat_history": chat_text},
+                                               template_type="jinja2")
+                                     for _, prompt_template in prompt_templates],
+                                   return_exceptions=True)
+
+    for (column_name, _), result in zip(prompt_templates, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error calling LLM client for {column_name}: {result}")
+            result = ""
+        client_profile[column_name] = result
+
+    if not chat_history:
+        logger.warning("No chat history in the coverage window, skipping chat retrieval")
+        return _attach_chat_history(client_profile, chat_history, [])
+
+    chat_index = get_chat_embedding_index()
+
+    async with llm_concurrency_limiter():
+        message_hashes = await chat_index.aupdate(chat_history)
+
+    async with llm_concurrency_limiter():
+        relevant_chat_documents = await chat_index.asimilarity_search(_chat_retriever_query(client_profile),
+                                                                      message_hashes,
+                                                                      k=CHAT_RETRIEVER_K,
+                                                                      score_threshold=CHAT_RETRIEVER_SCORE_THRESHOLD)
+
+    return _attach_chat_history(client_profile, chat_history, relevant_chat_documents)
@@ -0,0 +1,282 @@
+import os
+import time
+import queue
+import sqlite3
+import asyncio
+import hashlib
+import threading
+import numpy as np
+from loguru import logger
+from typing import Dict, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+from langchain_openai import AzureOpenAIEmbeddings
+
+from settings import settings
+
+
+def build_embeddings() -> AzureOpenAIEmbeddings:
+    return AzureOpenAIEmbeddings(
+        azure_endpoint=settings.azure_openai_embeddings_endpoint,
+        azure_deployment=settings.azure_openai_embeddings_deployment_name,
+        openai_api_version=settings.azure_openai_embeddings_api_version,
+        openai_api_key=settings.azure_openai_embeddings_api_key,
+    )
+
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text with the OpenAI tokenizers
+    return max(1, len(text) // 4)
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed cache of embedding vectors.
+
+    Vectors are appended as float32 rows to `vectors.f32`, read back through a
+    memory map, and located by a SQLite index of key -> row. Rows are written
+    before their index entries are committed, so an interrupted write leaves
+    only unreferenced trailing bytes, which are truncated on the next open.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._connection = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._connection.commit()
+
+        row = self._connection.execute("SELECT value FROM meta WHERE name = 'dimension'").fetchone()
+        self.dimension = int(row[0]) if row else None
+
+        self._n_rows = 0
+        self._mmap = None
+        if self.dimension:
+            row_bytes = 4 * self.dimension
+            size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+            self._n_rows = size // row_bytes
+            if size != self._n_rows * row_bytes:
+                os.truncate(self._vectors_path, self._n_rows * row_bytes)
+            self._connection.execute("DELETE FROM vectors WHERE row >= ?", (self._n_rows,))
+            self._connection.commit()
+
+    def __len__(self) -> int:
+        return self._n_rows
+
+    def _vectors(self) -> np.ndarray:
+        if self._mmap is None or len(self._mmap) != self._n_rows:
+            self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._n_rows, self.dimension))
+        return self._mmap
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys or not self._n_rows:
+            return {}
+
+        rows = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                cursor = self._connection.execute(f"SELECT key, row FROM vectors WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                rows.update(cursor.fetchall())
+            if not rows:
+                return {}
+            vectors = self._vectors()[list(rows.values())]
+
+        return dict(zip(rows.keys(), vectors))
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not keys:
+            return
+
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+                self._connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dimension', ?)", (str(self.dimension),))
+            elif vectors.shape[1] != self.dimension:
+                logger.warning(f"[EmbeddingCache] Not caching {vectors.shape[1]}-d vectors in a {self.dimension}-d cache at {self.path}")
+                return
+
+            known = self._connection.execute(f"SELECT key FROM vectors WHERE key IN ({','.join('?' * len(keys))})", keys).fetchall()
+            known = {key for key, in known}
+            keep = [i for i, key in enumerate(keys) if key not in known]
+            if not keep:
+                return
+
+            with open(self._vectors_path, "ab") as vectors_file:
+                vectors_file.write(vectors[keep].tobytes())
+            self._connection.executemany("INSERT INTO vectors (key, row) VALUES (?, ?)",
+                                         [(keys[i], self._n_rows + offset) for offset, i in enumerate(keep)])
+            self._connection.commit()
+            self._n_rows += len(keep)
+
+
+class EmbeddingService(Embeddings):
+    """
+    Process-wide embeddings shared by the publication and chat indexes.
+
+    Texts are keyed by the sha256 of (deployment, text). Cached vectors are
+    served from the EmbeddingCache, identical texts requested concurrently share
+    one request, and the remaining texts from all callers are coalesced by a
+    background thread into batches of up to `max_batch_size`, sent at most
+    `max_wait_seconds` after the first one arrives.
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 cache: Optional[EmbeddingCache] = None,
+                 deployment: str = "",
+                 max_batch_size: int = 256,
+                 max_wait_seconds: float = 0.02,
+                 max_concurrent_batches: int = 4):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.deployment = deployment
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="embedding-batch")
+        self._batcher = None
+
+        self.requested_texts      = 0
+        self.cache_hits           = 0
+        self.coalesced_texts      = 0
+        self.embedded_texts       = 0
+        self.batches              = 0
+        self.tokens_saved_estimate = 0
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.deployment}\x1f{text}".encode("utf-8")).hexdigest()
+
+    def _ensure_batcher(self):
+        if self._batcher is None:
+            with self._lock:
+                if self._batcher is None:
+                    self._batcher = threading.Thread(target=self._run_batcher, name="embedding-batcher", daemon=True)
+                    self._batcher.start()
+
+    def _run_batcher(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._embed_batch, batch)
+
+    def _embed_batch(self, batch: list):
+        keys = [key for key, _ in batch]
+        texts = [text for _, text in batch]
+        try:
+            vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+            if self.cache is not None:
+                self.cache.put_many(keys, vectors)
+        except Exception as e:
+            with self._lock:
+                futures = [self._inflight.pop(key) for key in keys]
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            self.batches += 1
+            self.embedded_texts += len(batch)
+            futures = [self._inflight.pop(key) for key in keys]
+        for future, vector in zip(futures, vectors):
+            future.set_result(vector)
+
+    def _resolve(self, texts: List[str]) -> List[Future]:
+        keys = [self._key(text) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        cached = self.cache.get_many(unique_keys) if self.cache is not None else {}
+
+        futures, pending = {}, []
+        cache_hits, coalesced = 0, 0
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in futures:
+                    coalesced += 1
+                elif key in cached:
+                    future = Future()
+                    future.set_result(cached[key])
+                    futures[key] = future
+                    cache_hits += 1
+                elif key in self._inflight:
+                    futures[key] = self._inflight[key]
+                    coalesced += 1
+                else:
+                    futures[key] = self._inflight[key] = Future()
+                    pending.append((key, text))
+
+            self.requested_texts += len(texts)
+            self.cache_hits += cache_hits
+            self.coalesced_texts += coalesced
+            self.tokens_saved_estimate += sum(_estimate_tokens(text) for text in texts) - sum(_estimate_tokens(text) for _, text in pending)
+
+        if pending:
+            self._ensure_batcher()
+            for item in pending:
+                self._queue.put(item)
+
+        return [futures[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [future.result().tolist() for future in self._resolve(list(texts))]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        futures = self._resolve(list(texts))
+        vectors = await asyncio.gather(*[asyncio.wrap_future(future) for future in futures])
+        return [vector.tolist() for vector in vectors]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def stats(self) -> dict:
+        saved = self.requested_texts - self.embedded_texts
+        return {
+            "requested_texts": self.requested_texts,
+            "cache_hits": self.cache_hits,
+            "coalesced_texts": self.coalesced_texts,
+            "embedded_texts": self.embedded_texts,
+            "batches": self.batches,
+            "hit_rate": saved / self.requested_texts if self.requested_texts else 0.0,
+            "tokens_saved_estimate": self.tokens_saved_estimate,
+            "cached_vectors": len(self.cache) if self.cache is not None else 0,
+        }
+
+
+_EMBEDDING_SERVICE: Optional[EmbeddingService] = None
+_EMBEDDING_SERVICE_LOCK = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """Process-wide EmbeddingService for the configured Azure OpenAI embeddings deployment"""
+    global _EMBEDDING_SERVICE
+    if _EMBEDDING_SERVICE is None:
+        with _EMBEDDING_SERVICE_LOCK:
+            if _EMBEDDING_SERVICE is None:
+                cache = EmbeddingCache(settings.embedding_cache_path) if settings.embedding_cache_enabled else None
+                _EMBEDDING_SERVICE = EmbeddingService(build_embeddings(),
+                                                      cache=cache,
+                                                      deployment=settings.azure_openai_embeddings_deployment_name,
+                                                      max_batch_size=settings.embedding_batch_size,
+                                                      max_wait_seconds=settings.embedding_batch_wait_ms / 1000,
+                                                      max_concurrent_batches=settings.embedding_max_concurrent_batches)
+    return _EMBEDDING_SERVICE
@@ -0,0 +1,775 @@
+import os
+import re
+import time
+import hashlib
+import itertools
+import threading
+import faiss
+import numpy as np
+import pandas as pd
+from loguru import logger
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from settings import settings
+from cores.bm25_functions import BM25Index
+from cores.embedding_functions import EmbeddingService, get_embedding_service
+from cores.publication_functions import (EXTRACTION_FAILED_COLUMN,
+                                        PUBLICATION_STORE_FILE_NAME,
+                                        PublicationStore,
+                                        iter_publication_batches,
+                                        iter_publication_chunks,
+                                        publication_key,
+                                        publication_feature_extraction)
+
+
+INDEX_FILE_NAMES = ("index.faiss", "index.pkl")
+INDEX_FACTORY_FILE_NAME = "index_factory.txt"
+DEFAULT_INDEX_FACTORY = "Flat"
+
+
+def apply_search_parameters(index: faiss.Index, nprobe: int, ef_search: int) -> faiss.Index:
+    """Set the IVF `nprobe` and HNSW `efSearch` query-time knobs the index supports"""
+    parameter_space = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        try:
+            parameter_space.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+    return index
+
+
+def train_faiss_index(source: faiss.Index,
+                      index_factory: str,
+                      max_training_points: int,
+                      batch_size: int = 65536) -> faiss.Index:
+    """
+    Copy the vectors of `source` into a new `index_factory` index, in the same
+    positions, after training it on a random sample of up to
+    `max_training_points` of them. Converting from a quantized index re-encodes
+    its approximate vectors.
+    """
+    try:
+        faiss.extract_index_ivf(source).make_direct_map()
+    except RuntimeError:
+        pass
+
+    index = faiss.index_factory(source.d, index_factory, source.metric_type)
+    if not index.is_trained:
+        n_train = min(source.ntotal, max_training_points)
+        ids = np.sort(np.random.default_rng(0).choice(source.ntotal, n_train, replace=False))
+        index.train(source.reconstruct_batch(ids))
+
+    for start in range(0, source.ntotal, batch_size):
+        index.add(source.reconstruct_n(start, min(batch_size, source.ntotal - start)))
+    return index
+
+
+def selector_search_parameters(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """Search parameters restricting `index` to `selector`; IVF indexes keep their nprobe"""
+    try:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(index).nprobe)
+    except RuntimeError:
+        return faiss.SearchParameters(sel=selector)
+
+
+# LangChain's FAISS keeps the L2 normalization flag, the relevance function and
+# the in-memory docstore private; every direct read of them goes through these
+# helpers, which fall back to the public constructor state if they move.
+def faiss_normalizes_l2(vectorstore: FAISS) -> bool:
+    """Whether `vectorstore` L2-normalizes its embeddings before searching"""
+    return bool(getattr(vectorstore, "_normalize_L2", False))
+
+
+def faiss_relevance_score_fn(vectorstore: FAISS) -> Callable[[float], float]:
+    """The function LangChain's FAISS maps raw index distances to relevance scores with"""
+    try:
+        return vectorstore._select_relevance_score_fn()
+    except AttributeError:
+        pass
+    if getattr(vectorstore, "override_relevance_score_fn", None) is not None:
+        return vectorstore.override_relevance_score_fn
+    distance_strategy = getattr(vectorstore, "distance_strategy", DistanceStrategy.EUCLIDEAN_DISTANCE)
+    if distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        return lambda distance: 1.0 - distance if distance > 0 else -distance
+    if distance_strategy == DistanceStrategy.COSINE:
+        return lambda distance: 1.0 - distance
+    return lambda distance: 1.0 - distance / np.sqrt(2)
+
+
+def faiss_documents(vectorstore: FAISS) -> Iterator[Document]:
+    """Every document of `vectorstore`, in index position order"""
+    for position in sorted(vectorstore.index_to_docstore_id):
+        document = vectorstore.docstore.search(vectorstore.index_to_docstore_id[position])
+        if isinstance(document, Document):
+            yield document
+
+
+UNKNOWN_DAY = np.iinfo(np.int32).min
+METADATA_TAG_FIELDS = ("region", "asset_class")
+
+_TAG_SEPARATORS = re.compile(r"[;,]")
+
+
+def day_number(value) -> int:
+    """Days since 1970-01-01 of a date such as 20250822, "2025-08-22" or a timestamp"""
+    return int((pd.Timestamp(str(value)).normalize() - pd.Timestamp(0)) // pd.Timedelta(days=1))
+
+
+def _tag_values(value) -> List[str]:
+    if isinstance(value, (list, tuple, np.ndarray)):
+        items = value
+    elif value is None or (isinstance(value, float) and np.isnan(value)):
+        items = []
+    else:
+        items = _TAG_SEPARATORS.split(str(value))
+    return [str(item).strip().lower() for item in items if str(item).strip()]
+
+
+class PublicationMetadataIndex:
+    """
+    Publish day, regions and asset classes of the publication behind every
+    FAISS position, to restrict retrieval to a date window and tags.
+
+    Publication-level values are kept once per publication and mapped to the
+    positions through `position_publications`; tags are (publication, code)
+    pairs over a per-field vocabulary, so multi-valued tags need no special
+    case. Built in memory from the PublicationStore and extended with the
+    positions a vectorstore gains, like the BM25 index.
+    """
+
+    def __init__(self,
+                 docstore_ids: np.ndarray,
+                 position_publications: np.ndarray,
+                 publication_rows: Dict[str, int],
+                 published_days: np.ndarray,
+                 tags: Dict[str, Tuple[Dict[str, int], np.ndarray, np.ndarray]]):
+        self.docstore_ids = docstore_ids
+        self.position_publications = position_publications
+        self.publication_rows = publication_rows
+        self.published_days = published_days
+        self.tags = tags
+
+    def __len__(self) -> int:
+        return len(self.docstore_ids)
+
+    @classmethod
+    def empty(cls) -> "PublicationMetadataIndex":
+        return cls(docstore_ids=np.array([], dtype=str),
+                   position_publications=np.array([], dtype=np.int32),
+                   publication_rows={},
+                   published_days=np.array([], dtype=np.int32),
+                   tags={field: ({}, np.array([], dtype=np.int32), np.array([], dtype=np.int32)) for field in METADATA_TAG_FIELDS})
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore: FAISS, publication_store: PublicationStore) -> "PublicationMetadataIndex":
+        return cls.empty().extend_from_vectorstore(vectorstore, publication_store)
+
+    def extend_from_vectorstore(self, vectorstore: FAISS, publication_store: PublicationStore) -> "PublicationMetadataIndex":
+        """New index with the positions the vectorstore gained since this one was built"""
+        docstore_ids = [vectorstore.index_to_docstore_id[i] for i in range(len(self), vectorstore.index.ntotal)]
+        metadatas = [vectorstore.docstore.search(docstore_id).metadata for docstore_id in docstore_ids]
+        keys = [publication_key(metadata) for metadata in metadatas]
+
+        publication_rows = dict(self.publication_rows)
+        new_keys = [key for key in dict.fromkeys(keys) if key not in publication_rows]
+        stored = publication_store.get_many([key for key in new_keys if key])
+        # chunks indexed before the PublicationStore carry the publication fields themselves
+        chunk_metadatas = dict(zip(keys, metadatas))
+        records = [stored.get(key) or (chunk_metadatas[key] if key else {}) for key in new_keys]
+        for key in new_keys:
+            publication_rows[key] = len(publication_rows)
+        first_row = len(self.published_days)
+
+        dates = pd.to_datetime(pd.Series([record.get("published_date") or None for record in records], dtype=object),
+                               errors="coerce", utc=True, format="mixed")
+        days = ((dates.dt.tz_convert(None).dt.normalize() - pd.Timestamp(0)) // pd.Timedelta(days=1)).fillna(UNKNOWN_DAY)
+
+        tags = {}
+        for field, (vocabulary, publications, codes) in self.tags.items():
+            vocabulary = dict(vocabulary)
+            new_publications, new_codes = [], []
+            for row, record in enumerate(records, start=first_row):
+                for value in dict.fromkeys(_tag_values(record.get(field))):
+                    new_publications.append(row)
+                    new_codes.append(vocabulary.setdefault(value, len(vocabulary)))
+            tags[field] = (vocabulary,
+                           np.concatenate([publications, np.asarray(new_publications, dtype=np.int32)]),
+                           np.concatenate([codes, np.asarray(new_codes, dtype=np.int32)]))
+
+        return PublicationMetadataIndex(
+            docstore_ids=np.concatenate([self.docstore_ids, np.asarray(docstore_ids, dtype=str)]),
+            position_publications=np.concatenate([self.position_publications,
+                                                  np.asarray([publication_rows[key] for key in keys], dtype=np.int32)]),
+            publication_rows=publication_rows,
+            published_days=np.concatenate([self.published_days, days.to_numpy(dtype=np.int32)]),
+            tags=tags,
+        )
+
+    def is_prefix_of(self, vectorstore: FAISS) -> bool:
+        n = len(self)
+        if n > vectorstore.index.ntotal:
+            return False
+        return n == 0 or (self.docstore_ids[0] == vectorstore.index_to_docstore_id[0]
+                          and self.docstore_ids[n - 1] == vectorstore.index_to_docstore_id[n - 1])
+
+    def matches(self, vectorstore: FAISS) -> bool:
+        return len(self) == vectorstore.index.ntotal and self.is_prefix_of(vectorstore)
+
+    def allowed(self,
+                start_day: Optional[int] = None,
+                end_day: Optional[int] = None,
+                tag_values: Optional[Dict[str, List[str]]] = None) -> np.ndarray:
+        """
+        Bool mask over the FAISS positions whose publication was published in
+        [start_day, end_day] and carries one of the requested values of every
+        field in `tag_values`. Publications without a date or without a tag of
+        a field are not filtered out on it.
+        """
+        keep = np.ones(len(self.published_days), dtype=bool)
+
+        known = self.published_days != UNKNOWN_DAY
+        if start_day is not None:
+            keep &= ~known | (self.published_days >= start_day)
+        if end_day is not None:
+            keep &= ~known | (self.published_days <= end_day)
+
+        for field, values in (tag_values or {}).items():
+            if not values:
+                continue
+            vocabulary, publications, codes = self.tags[field]
+            wanted = [vocabulary[value] for value in _tag_values(list(values)) if value in vocabulary]
+            tagged = np.zeros(len(keep), dtype=bool)
+            tagged[publications] = True
+            matching = np.zeros(len(keep), dtype=bool)
+            matching[publications[np.isin(codes, wanted)]] = True
+            keep &= ~tagged | matching
+
+        return keep[self.position_publications]
+
+
+class EmptyPublicationIndexError(RuntimeError):
+    """No publication index on disk and no publication to build one from"""
+
+
+class PublicationIndex:
+    """
+    Long-lived publication vector store shared by every thread of the process.
+
+    The FAISS index is deserialized once and only reloaded when the files in
+    `embedding_folder_path` change on disk (mtime / size check). The BM25 index
+    of the same chunks is persisted in the same folder and loaded once per
+    FAISS version, next to the PublicationStore holding one copy of every
+    publication's features that the chunks point to.
+
+    New indexes are built flat while streaming and then re-trained into
+    settings.publication_index_factory; the factory of the index on disk is
+    recorded next to it so a changed setting triggers one re-training.
+    """
+
+    def __init__(self, embedding_folder_path: str, publication_file_path: str):
+        self.embedding_folder_path = embedding_folder_path
+        self.publication_file_path = publication_file_path
+
+        self._lock        = threading.Lock()
+        self._vectorstore = None
+        self._version     = None
+        self._bm25        = None
+        self._metadata    = None
+        self._publications = None
+        self._empty_source_version = None
+
+        self.reload_count       = 0
+        self.last_load_seconds  = 0.0
+        self.total_load_seconds = 0.0
+
+    @property
+    def embeddings(self) -> EmbeddingService:
+        return get_embedding_service()
+
+    @property
+    def publications(self) -> PublicationStore:
+        if self._publications is None:
+            self._publications = PublicationStore(os.path.join(self.embedding_folder_path, PUBLICATION_STORE_FILE_NAME))
+        return self._publications
+
+    def _disk_version(self) -> Optional[Tuple]:
+        version = []
+        for file_name in INDEX_FILE_NAMES:
+            try:
+                stat = os.stat(os.path.join(self.embedding_folder_path, file_name))
+            except FileNotFoundError:
+                return None
+            version.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(version)
+
+    def _source_version(self) -> Optional[Tuple]:
+        try:
+            stat = os.stat(self.publication_file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _indexed_keys(vectorstore: Optional[FAISS]) -> set:
+        if vectorstore is None:
+            return set()
+        return {publication_key(doc.metadata) for doc in faiss_documents(vectorstore)}
+
+    def _disk_index_factory(self) -> str:
+        try:
+            with open(os.path.join(self.embedding_folder_path, INDEX_FACTORY_FILE_NAME), encoding="utf-8") as factory_file:
+                return factory_file.read().strip() or DEFAULT_INDEX_FACTORY
+        except FileNotFoundError:
+            return DEFAULT_INDEX_FACTORY
+
+    def _retrain(self, vectorstore: FAISS, index_factory: str) -> str:
+        """Move the vectors into a settings.publication_index_factory index; returns the factory in use"""
+        start = time.perf_counter()
+        try:
+            index = train_faiss_index(vectorstore.index,
+                                      settings.publication_index_factory,
+                                      max_training_points=settings.publication_index_max_training_points)
+        except RuntimeError as e:
+            logger.warning(f"[PublicationIndex] Keeping the {index_factory} index, "
+                           f"could not build {settings.publication_index_factory}: {e}")
+            return index_factory
+
+        vectorstore.index = apply_search_parameters(index, settings.publication_index_nprobe, settings.publication_index_ef_search)
+        logger.info(f"[PublicationIndex] Trained {settings.publication_index_factory} index over {index.ntotal} chunks "
+                    f"in {time.perf_counter() - start:.3f}s")
+        return settings.publication_index_factory
+
+    def _ingest(self, vectorstore: Optional[FAISS]) -> Tuple[Optional[FAISS], int]:
+        indexed_keys = self._indexed_keys(vectorstore)
+        index_factory = self._disk_index_factory() if vectorstore is not None else DEFAULT_INDEX_FACTORY
+        n_read, n_added = 0, 0
+
+        # Publications are read, extracted, chunked and embedded batch by batch, so
+        # memory is bounded by the batch sizes rather than by the size of the archive
+        for pub_df in iter_publication_batches(self.publication_file_path, settings.publication_ingest_batch_size):
+            n_read += len(pub_df)
+            keys = pd.Series([publication_key(record) for record in pub_df.to_dict(orient="records")], index=pub_df.index)
+            is_new = ~keys.isin(indexed_keys) & ~keys.duplicated()
+            new_df = pub_df.loc[is_new].copy()
+            if new_df.empty:
+                continue
+            indexed_keys.update(keys[is_new])
+
+            new_df = publication_feature_extraction(new_df)
+            # publications with a failed extraction are not indexed, so the next ingest retries them
+            failed = new_df.pop(EXTRACTION_FAILED_COLUMN).astype(bool)
+            if failed.any():
+                logger.warning(f"[PublicationIndex] Leaving out {int(failed.sum())} publications with a failed feature extraction")
+                new_df = new_df.loc[~failed]
+                if new_df.empty:
+                    continue
+            self.publications.put_many(new_df.to_dict(orient="records"))
+
+            for documents in itertools.batched(iter_publication_chunks(new_df), settings.embedding_batch_size):
+                texts = [document.page_content for document in documents]
+                metadatas = [document.metadata for document in documents]
+                text_embeddings = list(zip(texts, self.embeddings.embed_documents(texts)))
+
+                if vectorstore is None:
+                    vectorstore = FAISS.from_embeddings(text_embeddings, embedding=self.embeddings, metadatas=metadatas)
+                else:
+                    vectorstore.add_embeddings(text_embeddings, metadatas=metadatas)
+
+            n_added += len(new_df)
+            logger.info(f"[PublicationIndex] Ingested {n_added} new publications out of {n_read} read")
+
+        trained_factory = index_factory
+        if vectorstore is not None and index_factory != settings.publication_index_factory:
+            trained_factory = self._retrain(vectorstore, index_factory)
+
+        if not n_added:
+            logger.info(f"[PublicationIndex] No new publications in {self.publication_file_path}")
+            if trained_factory == index_factory:
+                return vectorstore, 0
+
+        os.makedirs(self.embedding_folder_path, exist_ok=True)
+        vectorstore.save_local(self.embedding_folder_path)
+        factory_path = os.path.join(self.embedding_folder_path, INDEX_FACTORY_FILE_NAME)
+        with open(factory_path + ".tmp", "w", encoding="utf-8") as factory_file:
+            factory_file.write(trained_factory)
+        os.replace(factory_path + ".tmp", factory_path)
+        self._sync_bm25(vectorstore)
+        return vectorstore, n_added
+
+    def _sync_bm25(self, vectorstore: FAISS) -> BM25Index:
+        bm25 = self._bm25 if self._bm25 is not None else BM25Index.load(self.embedding_folder_path)
+        if bm25 is not None and bm25.matches(vectorstore):
+            self._bm25 = bm25
+            return bm25
+
+        start = time.perf_counter()
+        if bm25 is not None and bm25.is_prefix_of(vectorstore):
+            bm25 = bm25.extend_from_vectorstore(vectorstore)
+        else:
+            bm25 = BM25Index.from_vectorstore(vectorstore)
+        bm25.save(self.embedding_folder_path)
+        self._bm25 = bm25
+
+        logger.info(f"[PublicationIndex] Indexed {len(bm25)} chunks for BM25 in {time.perf_counter() - start:.3f}s")
+        return bm25
+
+    def bm25(self) -> BM25Index:
+        """BM25 index aligned with the FAISS positions of get()"""
+        vectorstore = self.get()
+        bm25 = self._bm25
+        if bm25 is not None and bm25.matches(vectorstore):
+            return bm25
+
+        with self._lock:
+            return self._sync_bm25(vectorstore)
+
+    def metadata(self, vectorstore: Optional[FAISS] = None) -> PublicationMetadataIndex:
+        """PublicationMetadataIndex aligned with the FAISS positions of `vectorstore` (default get())"""
+        vectorstore = vectorstore or self.get()
+        metadata = self._metadata
+        if metadata is not None and metadata.matches(vectorstore):
+            return metadata
+
+        with self._lock:
+            metadata = self._metadata
+            if metadata is not None and metadata.matches(vectorstore):
+                return metadata
+
+            start = time.perf_counter()
+            if metadata is not None and metadata.is_prefix_of(vectorstore):
+                metadata = metadata.extend_from_vectorstore(vectorstore, self.publications)
+            else:
+                metadata = PublicationMetadataIndex.from_vectorstore(vectorstore, self.publications)
+            self._metadata = metadata
+
+        logger.info(f"[PublicationIndex] Indexed the metadata of {len(metadata)} chunks in {time.perf_counter() - start:.3f}s")
+        return metadata
+
+    def ingest(self) -> int:
+        """
+        Extract, chunk and embed only the publications whose hash / publication_id
+        is not in the index yet, append them and persist the index.
+
+        Returns:
+            int: Number of publications added
+        """
+        with self._lock:
+            vectorstore = self._vectorstore
+            if vectorstore is None or self._disk_version() != self._version:
+                vectorstore = self._load() if self._disk_version() is not None else None
+
+            vectorstore, n_added = self._ingest(vectorstore)
+
+            self._vectorstore = vectorstore
+            self._version = self._disk_version()
+
+        return n_added
+
+    def _load(self) -> FAISS:
+        vectorstore = FAISS.load_local(
+            self.embedding_folder_path,
+            embeddings=self.embeddings,
+            allow_dangerous_deserialization=True,
+        )
+        apply_search_parameters(vectorstore.index, settings.publication_index_nprobe, settings.publication_index_ef_search)
+        return vectorstore
+
+    def get(self) -> FAISS:
+        """
+        The publication vector store, reloaded if the index on disk changed and
+        built from publication_file_path if there is none yet.
+
+        Raises EmptyPublicationIndexError when neither yields a single chunk; the
+        publications file is only read again for that once it changes.
+        """
+        version = self._disk_version()
+        if self._vectorstore is not None and version == self._version:
+            return self._vectorstore
+
+        with self._lock:
+            version = self._disk_version()
+            if self._vectorstore is not None and version == self._version:
+                return self._vectorstore
+
+            if version is None and self._empty_source_version is not None and self._empty_source_version == self._source_version():
+                raise EmptyPublicationIndexError(f"No publication index in {self.embedding_folder_path} and "
+                                                 f"no publication to index in {self.publication_file_path}")
+
+            start = time.perf_counter()
+            source_version = self._source_version()
+            vectorstore = self._load() if version is not None else self._ingest(None)[0]
+            elapsed = time.perf_counter() - start
+
+            if vectorstore is None:
+                self._empty_source_version = source_version
+                raise EmptyPublicationIndexError(f"No publication index in {self.embedding_folder_path} and "
+                                                 f"no publication to index in {self.publication_file_path}")
+
+            self._vectorstore = vectorstore
+            self._version = self._disk_version()
+            self.reload_count += 1
+            self.last_load_seconds = elapsed
+            self.total_load_seconds += elapsed
+
+            logger.info(f"[PublicationIndex] Loaded {self.embedding_folder_path} "
+                        f"in {elapsed:.3f}s (reload #{self.reload_count})")
+
+        return self._vectorstore
+
+    def stats(self) -> dict:
+        return {
+            "embedding_folder_path": self.embedding_folder_path,
+            "index_factory": self._disk_index_factory(),
+            "reload_count": self.reload_count,
+            "last_load_seconds": self.last_load_seconds,
+            "total_load_seconds": self.total_load_seconds,
+        }
+
+
+_PUBLICATION_INDEXES: dict[str, PublicationIndex] = {}
+_PUBLICATION_INDEXES_LOCK = threading.Lock()
+
+
+def get_publication_index(embedding_folder_path: Optional[str] = None,
+                          publication_file_path: Optional[str] = None) -> PublicationIndex:
+    embedding_folder_path = embedding_folder_path or settings.embedding_folder_path
+    publication_file_path = publication_file_path or settings.publication_file_path
+
+    key = os.path.abspath(embedding_folder_path)
+    with _PUBLICATION_INDEXES_LOCK:
+        index = _PUBLICATION_INDEXES.get(key)
+        if index is None:
+            index = PublicationIndex(embedding_folder_path, publication_file_path)
+            _PUBLICATION_INDEXES[key] = index
+    return index
+
+
+def _chat_message_datetime(value) -> Optional[pd.Timestamp]:
+    try:
+        timestamp = pd.Timestamp(str(value).removesuffix(" UTC")) if isinstance(value, str) else pd.Timestamp(value)
+    except (TypeError, ValueError):
+        return None
+    if pd.isna(timestamp):
+        return None
+    return timestamp.tz_localize("UTC") if timestamp.tz is None else timestamp.tz_convert("UTC")
+
+
+def chat_message_hash(chat_item: dict) -> str:
+    """Stable id of a chat message: sha256 of room_id, UTC datetime, uuid and msg"""
+    timestamp = _chat_message_datetime(chat_item.get("datetimeutc"))
+    parts = [str(chat_item.get("room_id", "")),
+             timestamp.isoformat() if timestamp is not None else str(chat_item.get("datetimeutc", "")),
+             str(chat_item.get("uuid", "")),
+             str(chat_item.get("msg", ""))]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ChatEmbeddingIndex:
+    """
+    Persistent embedding index of Bloomberg chat messages shared by every client.
+
+    Messages are keyed by chat_message_hash, so a daily run only embeds the
+    messages it has not seen before. Searches are restricted to one client's
+    messages with a FAISS ID selector, and prune() ages out messages older than
+    the coverage window. Changes are written to disk by flush().
+    """
+
+    def __init__(self, embedding_folder_path: str):
+        self.embedding_folder_path = embedding_folder_path
+
+        self._lock        = threading.Lock()
+        self._vectorstore = None
+        self._positions   = {}
+        self._loaded      = False
+        self._dirty       = False
+
+        self.embedded_count = 0
+        self.reused_count   = 0
+        self.pruned_count   = 0
+
+    @property
+    def embeddings(self) -> EmbeddingService:
+        return get_embedding_service()
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._positions)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if all(os.path.exists(os.path.join(self.embedding_folder_path, file_name)) for file_name in INDEX_FILE_NAMES):
+                self._vectorstore = FAISS.load_local(self.embedding_folder_path,
+                                                     embeddings=self.embeddings,
+                                                     allow_dangerous_deserialization=True)
+                logger.info(f"[ChatEmbeddingIndex] Loaded {self._vectorstore.index.ntotal} messages from {self.embedding_folder_path}")
+            self._reindex_positions()
+            self._loaded = True
+
+    def _reindex_positions(self):
+        if self._vectorstore is None:
+            self._positions = {}
+        else:
+            self._positions = {message_hash: position for position, message_hash in self._vectorstore.index_to_docstore_id.items()}
+
+    def _new_messages(self, chat_history: list) -> Tuple[List[str], List[str], list]:
+        hashes = [chat_message_hash(chat_item) for chat_item in chat_history]
+
+        new_hashes, new_items = [], []
+        seen = set()
+        for message_hash, chat_item in zip(hashes, chat_history):
+            if message_hash in self._positions or message_hash in seen:
+                continue
+            seen.add(message_hash)
+            new_hashes.append(message_hash)
+            new_items.append(chat_item)
+
+        self.reused_count += len(hashes) - len(new_hashes)
+        return hashes, new_hashes, new_items
+
+    def _add(self, new_hashes: List[str], new_items: list, vectors: List[List[float]]):
+        texts = [str(chat_item.get("msg", "")) for chat_item in new_items]
+        metadatas = [{**chat_item, "message_hash": message_hash} for message_hash, chat_item in zip(new_hashes, new_items)]
+
+        with self._lock:
+            # another client may have added the same messages meanwhile
+            keep = [i for i, message_hash in enumerate(new_hashes) if message_hash not in self._positions]
+            if not keep:
+                return
+            text_embeddings = [(texts[i], vectors[i]) for i in keep]
+            ids = [new_hashes[i] for i in keep]
+
+            if self._vectorstore is None:
+                self._vectorstore = FAISS.from_embeddings(text_embeddings,
+                                                          embedding=self.embeddings,
+                                                          metadatas=[metadatas[i] for i in keep],
+                                                          ids=ids)
+                self._reindex_positions()
+            else:
+                start = self._vectorstore.index.ntotal
+                self._vectorstore.add_embeddings(text_embeddings, metadatas=[metadatas[i] for i in keep], ids=ids)
+                self._positions.update({message_hash: start + offset for offset, message_hash in enumerate(ids)})
+
+            self.embedded_count += len(ids)
+            self._dirty = True
+
+    def update(self, chat_history: list) -> List[str]:
+        """
+        Embed the messages of `chat_history` that are not indexed yet.
+
+        Returns:
+            List[str]: The message hash of every item of `chat_history`
+        """
+        self._ensure_loaded()
+        hashes, new_hashes, new_items = self._new_messages(chat_history)
+        if new_items:
+            vectors = self.embeddings.embed_documents([str(chat_item.get("msg", "")) for chat_item in new_items])
+            self._add(new_hashes, new_items, vectors)
+        return hashes
+
+    async def aupdate(self, chat_history: list) -> List[str]:
+        """Async variant of update built on the async embeddings API"""
+        self._ensure_loaded()
+        hashes, new_hashes, new_items = self._new_messages(chat_history)
+        if new_items:
+            vectors = await self.embeddings.aembed_documents([str(chat_item.get("msg", "")) for chat_item in new_items])
+            self._add(new_hashes, new_items, vectors)
+        return hashes
+
+    def _search(self, query_vector: List[float], hashes: List[str], k: int, score_threshold: float) -> List[Document]:
+        with self._lock:
+            if self._vectorstore is None:
+                return []
+            positions = np.array(sorted({self._positions[h] for h in hashes if h in self._positions}), dtype="int64")
+            if not len(positions):
+                return []
+
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(positions))
+            distances, indices = self._vectorstore.index.search(np.array([query_vector], dtype=np.float32),
+                                                                min(k, len(positions)),
+                                                                params=params)
+
+            relevance_score_fn = faiss_relevance_score_fn(self._vectorstore)
+            documents = []
+            for distance, position in zip(distances[0], indices[0]):
+                if position == -1 or relevance_score_fn(float(distance)) < score_threshold:
+                    continue
+                documents.append(self._vectorstore.docstore.search(self._vectorstore.index_to_docstore_id[int(position)]))
+            return documents
+
+    def similarity_search(self, query: str, hashes: List[str], k: int = 20, score_threshold: float = 0.5) -> List[Document]:
+        """Top `k` messages among `hashes` with a relevance score of at least `score_threshold`"""
+        if not hashes:
+            return []
+        return self._search(self.embeddings.embed_query(query), hashes, k, score_threshold)
+
+    async def asimilarity_search(self, query: str, hashes: List[str], k: int = 20, score_threshold: float = 0.5) -> List[Document]:
+        if not hashes:
+            return []
+        return self._search(await self.embeddings.aembed_query(query), hashes, k, score_threshold)
+
+    def prune(self, older_than) -> int:
+        """Remove the messages sent before `older_than`. Returns the number of messages removed"""
+        self._ensure_loaded()
+        cutoff = _chat_message_datetime(older_than)
+        with self._lock:
+            if self._vectorstore is None or cutoff is None:
+                return 0
+
+            expired = []
+            for message_hash in self._positions:
+                timestamp = _chat_message_datetime(self._vectorstore.docstore.search(message_hash).metadata.get("datetimeutc"))
+                if timestamp is None or timestamp < cutoff:
+                    expired.append(message_hash)
+            if not expired:
+                return 0
+
+            self._vectorstore.delete(expired)
+            self._reindex_positions()
+            self.pruned_count += len(expired)
+            self._dirty = True
+
+        logger.info(f"[ChatEmbeddingIndex] Pruned {len(expired)} messages older than {cutoff}")
+        return len(expired)
+
+    def flush(self):
+        """Persist the index if messages were added or pruned since the last flush"""
+        with self._lock:
+            if not self._dirty or self._vectorstore is None:
+                return
+            os.makedirs(self.embedding_folder_path, exist_ok=True)
+            self._vectorstore.save_local(self.embedding_folder_path)
+            self._dirty = False
+        logger.info(f"[ChatEmbeddingIndex] Saved {len(self._positions)} messages to {self.embedding_folder_path}")
+
+    def stats(self) -> dict:
+        return {
+            "embedding_folder_path": self.embedding_folder_path,
+            "size": len(self._positions),
+            "embedded_count": self.embedded_count,
+            "reused_count": self.reused_count,
+            "pruned_count": self.pruned_count,
+        }
+
+
+_CHAT_EMBEDDING_INDEXES: dict[str, ChatEmbeddingIndex] = {}
+_CHAT_EMBEDDING_INDEXES_LOCK = threading.Lock()
+
+
+def get_chat_embedding_index(embedding_folder_path: Optional[str] = None) -> ChatEmbeddingIndex:
+    embedding_folder_path = embedding_folder_path or settings.chat_embedding_folder_path
+
+    key = os.path.abspath(embedding_folder_path)
+    with _CHAT_EMBEDDING_INDEXES_LOCK:
+        index = _CHAT_EMBEDDING_INDEXES.get(key)
+        if index is None:
+            index = ChatEmbeddingIndex(embedding_folder_path)
+            _CHAT_EMBEDDING_INDEXES[key] = index
+    return index
@@ -1,15 +1,281 @@
+import os
+import json
+import time
+import httpx
+import sqlite3
+import asyncio
+import hashlib
+import weakref
+import threading
+from loguru import logger
 from pydantic import BaseModel
 from typing import Optional, Type
 
-from langchain.prompts import PromptTemplate
 from langchain_openai import AzureChatOpenAI
 
 from settings import settings
+from cores.prompt_functions import format_prompt
+
+
+_HTTP_CLIENT: Optional[httpx.Client] = None
+_LLM_CLIENTS: dict = {}
+_LLM_CLIENTS_LOCK = threading.Lock()
+
+_ASYNC_HTTP_CLIENTS = weakref.WeakKeyDictionary()
+_ASYNC_LLM_CLIENTS = weakref.WeakKeyDictionary()
+_LLM_SEMAPHORES = weakref.WeakKeyDictionary()
+
+
+def _get_http_client() -> httpx.Client:
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        _HTTP_CLIENT = httpx.Client(limits=httpx.Limits(max_connections=settings.llm_http_max_connections,
+                                                        max_keepalive_connections=settings.llm_http_max_connections))
+    return _HTTP_CLIENT
+
+
+def _build_llm_client(output_schema: Optional[Type[BaseModel]] = None, **kwargs):
+    llm = AzureChatOpenAI(
+        azure_endpoint=settings.azure_openai_endpoint,
+        azure_deployment=settings.azure_openai_deployment_name,
+        openai_api_version=settings.azure_openai_api_version,
+        openai_api_key=settings.azure_openai_api_key,
+        **kwargs
+    )
+    if output_schema is not None:
+        llm = llm.with_structured_output(output_schema)
+    return llm
+
+
+def _llm_client_key(output_schema: Optional[Type[BaseModel]], kwargs: dict) -> tuple:
+    return (settings.azure_openai_deployment_name, repr(sorted(kwargs.items())), output_schema)
+
+
+def get_llm_client(output_schema: Optional[Type[BaseModel]] = None, **kwargs):
+    """
+    Return a process-wide Azure OpenAI client for the given kwargs and output schema.
+
+    Clients are keyed by (deployment, kwargs, output_schema) and share a single
+    HTTP connection pool, so repeated calls skip client construction and TLS setup.
+    The structured-output runnable is built once per schema.
+    """
+    key = _llm_client_key(output_schema, kwargs)
+
+    llm = _LLM_CLIENTS.get(key)
+    if llm is not None:
+        return llm
+
+    with _LLM_CLIENTS_LOCK:
+        llm = _LLM_CLIENTS.get(key)
+        if llm is None:
+            llm = _build_llm_client(output_schema, **{"http_client": _get_http_client(), **kwargs})
+            _LLM_CLIENTS[key] = llm
+
+    return llm
+
+
+def get_async_llm_client(output_schema: Optional[Type[BaseModel]] = None, **kwargs):
+    """
+    Async counterpart of get_llm_client.
+
+    httpx async connections are bound to the event loop that opened them, so the
+    registry and its connection pool are kept per running loop.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _ASYNC_LLM_CLIENTS.setdefault(loop, {})
+    key = _llm_client_key(output_schema, kwargs)
+
+    llm = clients.get(key)
+    if llm is None:
+        http_async_client = _ASYNC_HTTP_CLIENTS.get(loop)
+        if http_async_client is None:
+            http_async_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=settings.llm_http_max_connections,
+                                                                      max_keepalive_connections=settings.llm_http_max_connections))
+            _ASYNC_HTTP_CLIENTS[loop] = http_async_client
+        llm = _build_llm_client(output_schema, **{"http_async_client": http_async_client, **kwargs})
+        clients[key] = llm
+
+    return llm
+
+
+def llm_concurrency_limiter() -> asyncio.Semaphore:
+    """
+    Global cap on in-flight async requests to Azure OpenAI (settings.llm_max_concurrency),
+    shared by every coroutine running on the current event loop.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _LLM_SEMAPHORES.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(settings.llm_max_concurrency)
+        _LLM_SEMAPHORES[loop] = semaphore
+    return semaphore
+
+
+class LLMResponseCache:
+    """
+    Persistent content-addressed cache of LLM responses backed by SQLite.
+
+    Entries are keyed by the rendered prompt, the deployment name, the output
+    schema's JSON schema and the client kwargs. Entries older than `ttl_seconds`
+    are treated as misses, and the least recently used entries are evicted once
+    the stored payload exceeds `max_bytes`.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_bytes: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                 "key TEXT PRIMARY KEY, "
+                                 "value TEXT NOT NULL, "
+                                 "size INTEGER NOT NULL, "
+                                 "created_at REAL NOT NULL, "
+                                 "accessed_at REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._connection.commit()
+        self._total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(formatted_prompt: str,
+                 deployment: str,
+                 output_schema: Optional[Type[BaseModel]] = None,
+                 **kwargs) -> str:
+        payload = json.dumps({
+            "prompt": formatted_prompt,
+            "deployment": deployment,
+            "output_schema": output_schema.model_json_schema() if output_schema is not None else None,
+            "kwargs": repr(sorted(kwargs.items())),
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, size, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, size, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                self._total_bytes -= size
+                self.misses += 1
+                return None
+
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.hits += 1
+
+        return json.loads(value)
+
+    def put(self, key: str, value):
+        now = time.time()
+        value = json.dumps(value)
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            row = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute("INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) "
+                                     "VALUES (?, ?, ?, ?, ?)", (key, value, size, now, now))
+            self._total_bytes += size - (row[0] if row else 0)
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        if not self.max_bytes or self._total_bytes <= self.max_bytes:
+            return
+        cursor = self._connection.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC")
+        evicted_keys = []
+        for key, size in cursor:
+            if self._total_bytes <= self.max_bytes:
+                break
+            evicted_keys.append((key,))
+            self._total_bytes -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+        logger.debug(f"[LLMResponseCache] Evicted {len(evicted_keys)} entries")
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+            self._total_bytes = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._total_bytes}
+
+
+class LLMBudgetExceeded(RuntimeError):
+    pass
+
+
+class LLMRequestBudget:
+    """Thread-safe cap on the number of requests sent to Azure OpenAI during a run (0 = unlimited)."""
+
+    def __init__(self, max_requests: int = 0):
+        self.max_requests = max_requests
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def consume(self):
+        with self._lock:
+            if self.max_requests and self.used >= self.max_requests:
+                raise LLMBudgetExceeded(f"LLM request budget of {self.max_requests} exhausted")
+            self.used += 1
+
+    @property
+    def exhausted(self) -> bool:
+        return bool(self.max_requests) and self.used >= self.max_requests
+
+    def reset(self, max_requests: int):
+        with self._lock:
+            self.max_requests = max_requests
+            self.used = 0
+
+
+llm_request_budget = LLMRequestBudget(settings.llm_max_requests_per_run)
+
+
+_RESPONSE_CACHE: Optional[LLMResponseCache] = None
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+
+def get_response_cache() -> LLMResponseCache:
+    global _RESPONSE_CACHE
+    if _RESPONSE_CACHE is None:
+        with _RESPONSE_CACHE_LOCK:
+            if _RESPONSE_CACHE is None:
+                _RESPONSE_CACHE = LLMResponseCache(path=settings.llm_cache_path,
+                                                   ttl_seconds=settings.llm_cache_ttl_seconds,
+                                                   max_bytes=settings.llm_cache_max_bytes)
+    return _RESPONSE_CACHE
+
+
+def _lookup_cached_response(formatted_prompt,
+                            output_schema: Optional[Type[BaseModel]],
+                            use_cache: Optional[bool],
+                            kwargs: dict):
+    """Return (cache_key, cached_response); cache_key is None when the cache is bypassed."""
+    use_cache = settings.llm_cache_enabled if use_cache is None else use_cache
+    if not use_cache:
+        return None, None
+    cache_key = LLMResponseCache.make_key(formatted_prompt.to_string(), settings.azure_openai_deployment_name,
+                                          output_schema=output_schema, **kwargs)
+    return cache_key, get_response_cache().get(cache_key)
 
 
 def call_llm(prompt_template : str,
              prompt_inputs   : dict,
              template_type   : Optional[str] = "jinja2",
+             use_cache       : Optional[bool] = None,
              **kwargs) -> str:
     """
     Call Azure OpenAI GPT-4.1-mini model using LangChain
@@ -18,38 +284,37 @@ def call_llm(prompt_template : str,
         prompt_template: The prompt template string
         prompt_inputs: Dictionary of input variables for the template
         template_type: Type of template ("jinja2" or "f-string")
+        use_cache: Read and write the on-disk response cache, defaults to settings.llm_cache_enabled
 
     Returns:
         str: The generated response from the model
     """
 
-    # Initialize Azure OpenAI client
-    llm = AzureChatOpenAI(
-        azure_endpoint=settings.azure_openai_endpoint,
-        azure_deployment=settings.azure_openai_deployment_name,
-        openai_api_version=settings.azure_openai_api_version,
-        openai_api_key=settings.azure_openai_api_key,
-        **kwargs
-    )
+    # Reuse the pooled Azure OpenAI client
+    llm = get_llm_client(**kwargs)
 
-    # Create the prompt using the template
-    if template_type == "jinja2":
-        prompt = PromptTemplate.from_template(prompt_template, template_format="jinja2")
-        formatted_prompt = prompt.invoke(prompt_inputs)
-    else:
-        prompt = PromptTemplate(template=prompt_template, input_variables=list(prompt_inputs.keys()))
-        formatted_prompt = prompt.invoke(prompt_inputs)
+    # Render the prompt with the memoized compiled template
+    formatted_prompt = format_prompt(prompt_template, prompt_inputs, template_type)
+
+    cache_key, cached = _lookup_cached_response(formatted_prompt, None, use_cache, kwargs)
+    if cached is not None:
+        return cached
 
     # Call the model
-    response = llm.invoke(formatted_prompt)
+    llm_request_budget.consume()
+    response = llm.invoke(formatted_prompt).content
+
+    if cache_key is not None:
+        get_response_cache().put(cache_key, response)
 
-    return response.content
+    return response
 
 
 def call_structured_llm(prompt_template: str,
                         prompt_inputs: dict,
                         template_type: Optional[str] = "jinja2",
                         output_schema: Optional[Type[BaseModel]] = None,
+                        use_cache: Optional[bool] = None,
                         **kwargs) -> dict:
     """
     Call Azure OpenAI GPT-4.1-mini model with structured output using LangChain
@@ -59,32 +324,83 @@ def call_structured_llm(prompt_template: str,
         prompt_inputs: Dictionary of input variables for the template
         template_type: Type of template ("jinja2" or "f-string")
         output_schema: Pydantic model class for structured output
+        use_cache: Read and write the on-disk response cache, defaults to settings.llm_cache_enabled
 
     Returns:
         dict: The structured response parsed according to the output schema
     """
 
-    # Initialize Azure OpenAI client
-    llm = AzureChatOpenAI(
-        azure_endpoint=settings.azure_openai_endpoint,
-        azure_deployment=settings.azure_openai_deployment_name,
-        openai_api_version=settings.azure_openai_api_version,
-        openai_api_key=settings.azure_openai_api_key,
-        **kwargs
-    )
+    # Reuse the pooled Azure OpenAI client, already bound to the output schema
+    llm = get_llm_client(output_schema=output_schema, **kwargs)
 
-    # Create the prompt using the template
-    if template_type == "jinja2":
-        prompt = PromptTemplate.from_template(prompt_template, template_format="jinja2")
-        formatted_prompt = prompt.invoke(prompt_inputs)
-    else:
-        prompt = PromptTemplate(template=prompt_template, input_variables=list(prompt_inputs.keys()))
-        formatted_prompt = prompt.invoke(prompt_inputs)
+    # Render the prompt with the memoized compiled template
+    formatted_prompt = format_prompt(prompt_template, prompt_inputs, template_type)
 
-    llm = llm.with_structured_output(output_schema)
+    cache_key, cached = _lookup_cached_response(formatted_prompt, output_schema, use_cache, kwargs)
+    if cached is not None:
+        return cached
 
+    llm_request_budget.consume()
     response = llm.invoke(formatted_prompt).model_dump()
 
+    if cache_key is not None:
+        get_response_cache().put(cache_key, response)
+
+    return response
+
+
+async def acall_llm(prompt_template : str,
+                    prompt_inputs   : dict,
+                    template_type   : Optional[str] = "jinja2",
+                    use_cache       : Optional[bool] = None,
+                    **kwargs) -> str:
+    """
+    Async variant of call_llm using ainvoke, bounded by llm_concurrency_limiter
+    """
+
+    llm = get_async_llm_client(**kwargs)
+
+    formatted_prompt = format_prompt(prompt_template, prompt_inputs, template_type)
+
+    cache_key, cached = _lookup_cached_response(formatted_prompt, None, use_cache, kwargs)
+    if cached is not None:
+        return cached
+
+    llm_request_budget.consume()
+    async with llm_concurrency_limiter():
+        response = (await llm.ainvoke(formatted_prompt)).content
+
+    if cache_key is not None:
+        get_response_cache().put(cache_key, response)
+
+    return response
+
+
+async def acall_structured_llm(prompt_template: str,
+                               prompt_inputs: dict,
+                               template_type: Optional[str] = "jinja2",
+                               output_schema: Optional[Type[BaseModel]] = None,
+                               use_cache: Optional[bool] = None,
+                               **kwargs) -> dict:
+    """
+    Async variant of call_structured_llm using ainvoke, bounded by llm_concurrency_limiter
+    """
+
+    llm = get_async_llm_client(output_schema=output_schema, **kwargs)
+
+    formatted_prompt = format_prompt(prompt_template, prompt_inputs, template_type)
+
+    cache_key, cached = _lookup_cached_response(formatted_prompt, output_schema, use_cache, kwargs)
+    if cached is not None:
+        return cached
+
+    llm_request_budget.consume()
+    async with llm_concurrency_limiter():
+        response = (await llm.ainvoke(formatted_prompt)).model_dump()
+
+    if cache_key is not None:
+        get_response_cache().put(cache_key, response)
+
     return response
 
 
@@ -0,0 +1,80 @@
+import hashlib
+import threading
+from typing import Optional
+
+from jinja2.sandbox import SandboxedEnvironment
+from langchain.prompts import PromptTemplate
+from langchain_core.prompt_values import StringPromptValue
+
+
+_JINJA2_ENVIRONMENT = SandboxedEnvironment()
+
+_COMPILED_TEMPLATES: dict = {}
+_COMPILED_TEMPLATES_LOCK = threading.Lock()
+_COMPILE_CACHE_STATS = {"hits": 0, "misses": 0}
+
+
+def _template_key(prompt_template: str, template_type: str, input_variables: tuple) -> tuple:
+    return (hashlib.sha256(prompt_template.encode("utf-8")).hexdigest(), template_type, input_variables)
+
+
+def compile_prompt_template(prompt_template: str,
+                            template_type: Optional[str] = "jinja2",
+                            input_variables: Optional[list] = None):
+    """
+    Compile a prompt template once and memoize it by the hash of its text.
+
+    Args:
+        prompt_template: The prompt template string
+        template_type: Type of template ("jinja2" or "f-string")
+        input_variables: Input variable names, only used by f-string templates
+
+    Returns:
+        A compiled jinja2 Template, or a PromptTemplate for f-string templates
+    """
+    input_variables = () if template_type == "jinja2" else tuple(input_variables or ())
+    key = _template_key(prompt_template, template_type, input_variables)
+
+    # the lookup and the hit / miss counters share one lock, so concurrent callers are all counted
+    with _COMPILED_TEMPLATES_LOCK:
+        compiled = _COMPILED_TEMPLATES.get(key)
+        if compiled is not None:
+            _COMPILE_CACHE_STATS["hits"] += 1
+            return compiled
+
+        if template_type == "jinja2":
+            compiled = _JINJA2_ENVIRONMENT.from_string(prompt_template)
+        else:
+            compiled = PromptTemplate(template=prompt_template, input_variables=list(input_variables))
+
+        _COMPILED_TEMPLATES[key] = compiled
+        _COMPILE_CACHE_STATS["misses"] += 1
+
+    return compiled
+
+
+def format_prompt(prompt_template: str,
+                  prompt_inputs: dict,
+                  template_type: Optional[str] = "jinja2") -> StringPromptValue:
+    """
+    Render a prompt with the memoized compiled template.
+
+    Returns the same StringPromptValue as PromptTemplate.invoke.
+    """
+    if template_type == "jinja2":
+        compiled = compile_prompt_template(prompt_template, template_type)
+        return StringPromptValue(text=compiled.render(**prompt_inputs))
+
+    compiled = compile_prompt_template(prompt_template, template_type, list(prompt_inputs.keys()))
+    return compiled.invoke(prompt_inputs)
+
+
+def get_prompt_cache_stats() -> dict:
+    with _COMPILED_TEMPLATES_LOCK:
+        return {**_COMPILE_CACHE_STATS, "size": len(_COMPILED_TEMPLATES)}
+
+
+def clear_prompt_cache():
+    with _COMPILED_TEMPLATES_LOCK:
+        _COMPILED_TEMPLATES.clear()
+        _COMPILE_CACHE_STATS.update({"hits": 0, "misses": 0})
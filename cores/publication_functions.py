@@ -1,5 +1,13 @@
+import os
+import json
+import time
+import sqlite3
+import threading
 import pandas as pd
+from loguru import logger
+from typing import Dict, List, Optional
 from functools import partial
+from concurrent.futures import as_completed, ThreadPoolExecutor
 
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -8,26 +16,262 @@ from settings import settings
 from prompts.publication import (generate_keywords_prompt,
                                  generate_currencies_prompt, 
                                  generate_topics_prompt,
-                                 generate_instruments_prompt)
-from cores.llm_functions import call_llm
+                                 generate_instruments_prompt,
+                                 generate_publication_metadata_prompt)
+from custom_types import Publication, PublicationMetadataModel
+from cores.llm_functions import call_llm, call_structured_llm
 
 
-def publication_feature_extraction(pub_df: pd.DataFrame):
-    
-    llm_extract_topics_partial       = partial(call_llm, prompt_template=generate_topics_prompt())
-    llm_extract_keywords_partial     = partial(call_llm, prompt_template=generate_keywords_prompt())
-    llm_extract_currencies_partial   = partial(call_llm, prompt_template=generate_currencies_prompt())
-    llm_extract_instruments_partial  = partial(call_llm, prompt_template=generate_instruments_prompt())
+# Raw research export column -> Publication field, used when the field is missing
+RAW_PUBLICATION_COLUMNS = {
+    "clean_content" : "extracted_content",
+    "author"        : "attachment.author",
+    "language"      : "Language",
+    "asset_class"   : "tags.asset_class",
+    "region"        : "tags.region",
+    "currencies"    : "tags.currencies",
+}
 
-    pub_df.loc[:, "llm_extract_topics"]       = pub_df.loc[:, "clean_content"].apply(llm_extract_topics_partial)
-    pub_df.loc[:, "llm_extract_keywords"]     = pub_df.loc[:, "clean_content"].apply(llm_extract_keywords_partial)
-    pub_df.loc[:, "llm_extract_currencies"]   = pub_df.loc[:, "clean_content"].apply(llm_extract_currencies_partial)
-    pub_df.loc[:, "llm_extract_instruments"]  = pub_df.loc[:, "clean_content"].apply(llm_extract_instruments_partial)
 
+def publication_key(metadata: dict) -> str:
+    return str(metadata.get("hash") or metadata.get("publication_id") or "")
+
+
+PUBLICATION_STORE_FILE_NAME = "publications.sqlite"
+PUBLICATION_FIELDS = [field for field in Publication.model_fields if field != "metadata"]
+
+
+class PublicationStore:
+    """
+    Compact SQLite store of publication features keyed by publication_key.
+
+    Each publication is stored once, so index chunks only need to carry its
+    id and their offsets, and candidates are hydrated with one batched lookup.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS publications (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._connection.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM publications").fetchone()[0]
+
+    def put_many(self, records: List[dict]) -> int:
+        rows = [(publication_key(record), json.dumps({field: record.get(field) for field in PUBLICATION_FIELDS if field in record}, default=str))
+                for record in records]
+        rows = [row for row in rows if row[0]]
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO publications (key, data) VALUES (?, ?)", rows)
+            self._connection.commit()
+        return len(rows)
+
+    def get_many(self, keys: List[str]) -> Dict[str, dict]:
+        keys = list(dict.fromkeys(key for key in keys if key))
+        records = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                cursor = self._connection.execute(f"SELECT key, data FROM publications WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                records.update((key, json.loads(data)) for key, data in cursor)
+        return records
+
+
+def normalize_publication_columns(pub_df: pd.DataFrame) -> pd.DataFrame:
+    for column, raw_column in RAW_PUBLICATION_COLUMNS.items():
+        if column not in pub_df.columns and raw_column in pub_df.columns:
+            pub_df[column] = pub_df[raw_column]
+    for column in ("title", "summary", "clean_content", "language", "asset_class"):
+        if column not in pub_df.columns:
+            pub_df[column] = ""
     return pub_df
 
 
-def publication_preprocessing(pub_df: pd.DataFrame):
+def load_publications(publication_file_path: str) -> pd.DataFrame:
+    return normalize_publication_columns(pd.read_json(publication_file_path))
+
+
+def _iter_json_records(file_path: str, buffer_size: int = 1 << 20):
+    """
+    Yield the objects of a JSON array file, or of a JSON Lines file (.jsonl / .ndjson),
+    one at a time while holding at most `buffer_size` characters plus one record.
+    """
+    with open(file_path, encoding="utf-8") as json_file:
+        if file_path.endswith((".jsonl", ".ndjson")):
+            for line in json_file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer, position, opened = "", 0, False
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if not opened and position < len(buffer):
+                if buffer[position] != "[":
+                    raise ValueError(f"{file_path} is neither a JSON array nor JSON Lines")
+                opened = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == "]":
+                return
+
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                chunk = json_file.read(buffer_size)
+                if not chunk:
+                    if buffer[position:].strip():
+                        raise
+                    return
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield record
+
+
+def iter_publication_batches(publication_file_path: str, batch_size: int = 256):
+    """Stream the publications file as normalized DataFrames of at most `batch_size` rows"""
+    batch = []
+    for record in _iter_json_records(publication_file_path):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield normalize_publication_columns(pd.DataFrame.from_records(batch))
+            batch = []
+    if batch:
+        yield normalize_publication_columns(pd.DataFrame.from_records(batch))
+
+
+EXTRACTION_FAILED_COLUMN = "llm_extract_failed"
+
+PUBLICATION_EXTRACTORS = [
+    ("llm_extract_topics", generate_topics_prompt),
+    ("llm_extract_keywords", generate_keywords_prompt),
+    ("llm_extract_currencies", generate_currencies_prompt),
+    ("llm_extract_instruments", generate_instruments_prompt),
+]
+
+
+def _load_extraction_checkpoint(checkpoint_path: str) -> dict:
+    checkpoint = {}
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return checkpoint
+    with open(checkpoint_path, "r") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+                checkpoint[(record["key"], record["column"])] = record["value"]
+            except Exception:
+                # a crash can leave a truncated last line behind
+                continue
+    return checkpoint
+
+
+def _extract_single_feature(column: str, prompt_function, content: str) -> dict:
+    return {column: call_llm(prompt_template=prompt_function(), prompt_inputs={"article_content": content})}
+
+
+def _extract_combined_features(content: str) -> dict:
+    result = call_structured_llm(prompt_template=generate_publication_metadata_prompt(),
+                                 prompt_inputs={"article_content": content},
+                                 template_type="jinja2",
+                                 output_schema=PublicationMetadataModel)
+    return {column: "; ".join(result.get(column.removeprefix("llm_extract_")) or [])
+            for column, _ in PUBLICATION_EXTRACTORS}
+
+
+def publication_feature_extraction(pub_df: pd.DataFrame,
+                                   max_workers: Optional[int] = None,
+                                   checkpoint_path: Optional[str] = None,
+                                   mode: Optional[str] = None):
+    """
+    Run every (publication x extractor) LLM call on a bounded thread pool.
+
+    In "combined" mode a single structured-output call per publication fills all
+    llm_extract_* columns instead of the four separate prompts.
+
+    Each finished cell is appended to a JSON Lines checkpoint keyed by publication
+    hash / publication_id, so a crashed run resumes with only the missing cells.
+    Failed cells are left empty and their rows flagged in EXTRACTION_FAILED_COLUMN,
+    so the caller can leave them out and retry only those cells on the next run.
+    """
+    max_workers = settings.max_worker if max_workers is None else max_workers
+    checkpoint_path = settings.publication_extraction_checkpoint_path if checkpoint_path is None else checkpoint_path
+    mode = settings.publication_extraction_mode if mode is None else mode
+
+    if mode == "combined":
+        extractors = [(tuple(column for column, _ in PUBLICATION_EXTRACTORS), _extract_combined_features)]
+    else:
+        extractors = [((column,), partial(_extract_single_feature, column, prompt_function))
+                      for column, prompt_function in PUBLICATION_EXTRACTORS]
+
+    checkpoint = _load_extraction_checkpoint(checkpoint_path)
+    checkpoint_lock = threading.Lock()
+    if checkpoint_path:
+        os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+
+    keys = [publication_key(row) or f"row-{i}" for i, row in enumerate(pub_df.to_dict(orient="records"))]
+    contents = pub_df.loc[:, "clean_content"].tolist()
+    values = {column: [""] * len(pub_df) for column, _ in PUBLICATION_EXTRACTORS}
+    failed = [False] * len(pub_df)
+
+    def _extract(row_idx: int, extractor) -> dict:
+        result = extractor(contents[row_idx])
+        if checkpoint_path:
+            with checkpoint_lock, open(checkpoint_path, "a") as file:
+                for column, value in result.items():
+                    file.write(json.dumps({"key": keys[row_idx], "column": column, "value": value}) + "\n")
+        return result
+
+    start = time.perf_counter()
+    resumed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for row_idx, key in enumerate(keys):
+            for columns, extractor in extractors:
+                if all((key, column) in checkpoint for column in columns):
+                    for column in columns:
+                        values[column][row_idx] = checkpoint[(key, column)]
+                    resumed += 1
+                else:
+                    futures[executor.submit(_extract, row_idx, extractor)] = (row_idx, columns)
+
+        for future in as_completed(futures):
+            row_idx, columns = futures[future]
+            try:
+                for column, value in future.result().items():
+                    values[column][row_idx] = value
+            except Exception as e:
+                failed[row_idx] = True
+                logger.error(f"Publication feature extraction failed for {keys[row_idx]} ({', '.join(columns)}): {e}")
+
+    elapsed = time.perf_counter() - start
+    throughput = len(pub_df) / elapsed * 60 if elapsed else 0.0
+    logger.info(f"Publication feature extraction ({mode}): {len(pub_df)} publications, {len(futures)} LLM calls "
+                f"({resumed} resumed from checkpoint) in {elapsed:.1f}s, {throughput:.1f} publications/min")
+
+    for column, _ in PUBLICATION_EXTRACTORS:
+        pub_df.loc[:, column] = values[column]
+    pub_df.loc[:, EXTRACTION_FAILED_COLUMN] = failed
+
+    return pub_df
+
+
+def iter_publication_chunks(pub_df: pd.DataFrame):
+    """
+    Split publications one at a time and yield their chunks as Documents.
+
+    The chunk text is followed by the publication's title, summary and extracted
+    features. Chunks of publications with a hash / publication_id only carry
+    that id and their offsets in clean_content, the publication itself lives in
+    the PublicationStore.
+    """
     string_template = ("{page_content}\n\n"
                        "Publication title: {title}\n\n"
                        "Publication summary: {summary}\n\n"
@@ -37,28 +281,39 @@ def publication_preprocessing(pub_df: pd.DataFrame):
                        "Publication currencies: {llm_extract_currencies}\n\n"
                        "Publication topics: {llm_extract_topics}\n\n"
                        "Publication instruments: {llm_extract_instruments}\n\n")
-    
-    publications = pub_df.apply(lambda row: Document(page_content=row["clean_content"],
-                                                     metadata=row),
-                                            axis=1).tolist()
-    
 
-    # Split the text
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=settings.publication_chunk_size, 
                                                    chunk_overlap=settings.publication_chunk_overlap,
-                                                   separators=["\n\n", "\n", " ", ""])
-    
-    text_chunks = text_splitter.split_documents(publications)
-
-    for text_chunk in text_chunks:
-        text_chunk.page_content = string_template.format(page_content=text_chunk.page_content,
-                                                         title=text_chunk.metadata["title"],
-                                                         summary=text_chunk.metadata["summary"],
-                                                         language=text_chunk.metadata["language"],
-                                                         asset_class=text_chunk.metadata["asset_class"],
-                                                         llm_extract_keywords=text_chunk.metadata["llm_extract_keywords"],
-                                                         llm_extract_currencies=text_chunk.metadata["llm_extract_currencies"],
-                                                         llm_extract_topics=text_chunk.metadata["llm_extract_topics"],
-                                                         llm_extract_instruments=text_chunk.metadata.get("llm_extract_instruments", ""))
-
-    return text_chunks
\ No newline at end of file
+                                                   separators=["\n\n", "\n", " ", ""],
+                                                   add_start_index=True)
+
+    for row in pub_df.to_dict(orient="records"):
+        has_key = bool(publication_key(row))
+
+        for text_chunk in text_splitter.create_documents([row["clean_content"]]):
+            start_index = text_chunk.metadata.get("start_index", -1)
+            page_content = string_template.format(page_content=text_chunk.page_content,
+                                                  title=row["title"],
+                                                  summary=row["summary"],
+                                                  language=row["language"],
+                                                  asset_class=row["asset_class"],
+                                                  llm_extract_keywords=row["llm_extract_keywords"],
+                                                  llm_extract_currencies=row["llm_extract_currencies"],
+                                                  llm_extract_topics=row["llm_extract_topics"],
+                                                  llm_extract_instruments=row.get("llm_extract_instruments", ""))
+
+            if has_key:
+                metadata = {
+                    "publication_id": row.get("publication_id", ""),
+                    "hash": row.get("hash", ""),
+                    "start_index": start_index,
+                    "end_index": start_index + len(text_chunk.page_content) if start_index >= 0 else -1,
+                }
+            else:
+                metadata = {**row, "start_index": start_index}
+
+            yield Document(page_content=page_content, metadata=metadata)
+
+
+def publication_preprocessing(pub_df: pd.DataFrame):
+    return list(iter_publication_chunks(pub_df))
@@ -1,13 +1,16 @@
-import os
+import re
 import json
+import faiss
+import asyncio
+import threading
 import numpy as np
 import pandas as pd
-from typing import List
+from typing import List, Optional, Tuple
 from loguru import logger
 from datetime import datetime
+from concurrent.futures import as_completed, ThreadPoolExecutor
 
-from langchain_openai import AzureOpenAIEmbeddings
-from langchain_community.vectorstores import FAISS  
+from langchain.schema import Document
 
 from prompts.recsys import (
     get_currency_relevance_prompt,
@@ -16,87 +19,57 @@ from prompts.recsys import (
     get_passage_precision_prompt,
 )
 from settings import settings
-from utils.utils import replace_empty_string
-from cores.llm_functions import call_structured_llm
+from utils.utils import replace_empty_string, RateLimiter
+from cores.llm_functions import call_structured_llm, acall_structured_llm, llm_concurrency_limiter
 from custom_types import ClientProfile, Publication, RelevanceModel, Candidate, Passage, PassagePrecisionModel
-from cores.publication_functions import publication_feature_extraction, publication_preprocessing
+from cores.index_functions import (day_number,
+                                  faiss_normalizes_l2,
+                                  faiss_relevance_score_fn,
+                                  get_publication_index,
+                                  selector_search_parameters)
+from cores.publication_functions import publication_key
 
 
-def recsys_llm(client_profile: ClientProfile, candidates: List[Publication]):
+RELEVANCE_PROMPTS = [
+    ("Currency Relevance", get_currency_relevance_prompt),
+    ("Chat Topic Relevance", get_chat_topic_relevance_prompt),
+    ("Chat Product Relevance", get_chat_product_relevance_prompt),
+]
+
+
+def _ensure_result_shape(result_dict):
+    try:
+        score = result_dict.get("score", 0)
+        evidences = result_dict.get("evidences", [])
+    except Exception:
+        score = 0
+        evidences = []
+    return {"score": score, "evidences": evidences}
+
+
+def _build_relevance_prompt_inputs(client_profile: ClientProfile, candidate: Publication) -> dict:
+    return {
+        "client_chat_currencies": client_profile.chat_currencies,
+        "client_chat_interest": client_profile.chat_interest,
+        "client_chat_summary": client_profile.chat_summary,
+        "client_chat_products": client_profile.chat_products,
+        "candidate_title": candidate.title or "",
+        "candidate_summary": candidate.summary or "",
+        "candidate_currencies": candidate.llm_extract_currencies or "",
+        "candidate_topics": candidate.llm_extract_topics or "",
+        "candidate_keywords": candidate.llm_extract_keywords or "",
+        "candidate_instruments": candidate.llm_extract_instruments or "",
+    }
 
+
+def _build_recsys_output(candidates: List[Publication], results: List[List[dict]]) -> pd.DataFrame:
     output_dicts = []
 
-    for candidate in candidates:
+    for candidate, (currency_result, chat_topic_result, chat_product_result) in zip(candidates, results):
         output_dict = {
             "title": candidate.title
         }
 
-        def _ensure_result_shape(result_dict):
-            try:
-                score = result_dict.get("score", 0)
-                evidences = result_dict.get("evidences", [])
-            except Exception:
-                score = 0
-                evidences = []
-            return {"score": score, "evidences": evidences}
-
-        def _call_structured_llm_wrapper(**kwargs):
-            return call_structured_llm(**kwargs)
-
-        def _sequential_structured_llm_calls():
-            prompt_inputs_common = {
-                "client_chat_currencies": client_profile.chat_currencies,
-                "client_chat_interest": client_profile.chat_interest,
-                "client_chat_summary": client_profile.chat_summary,
-                "client_chat_products": client_profile.chat_products,
-                "candidate_title": candidate.title or "",
-                "candidate_summary": candidate.summary or "",
-                "candidate_currencies": candidate.llm_extract_currencies or "",
-                "candidate_topics": candidate.llm_extract_topics or "",
-                "candidate_keywords": candidate.llm_extract_keywords or "",
-                "candidate_instruments": candidate.llm_extract_instruments or "",
-            }
-
-            prompts = [
-                {
-                    "prompt_template": get_currency_relevance_prompt(),
-                    "output_schema": RelevanceModel,
-                    "template_type": "jinja2",
-                    "name": "Currency Relevance",
-                    "prompt_inputs": prompt_inputs_common,
-                },
-                {
-                    "prompt_template": get_chat_topic_relevance_prompt(),
-                    "output_schema": RelevanceModel,
-                    "template_type": "jinja2",
-                    "name": "Chat Topic Relevance",
-                    "prompt_inputs": prompt_inputs_common,
-                },
-                {
-                    "prompt_template": get_chat_product_relevance_prompt(),
-                    "output_schema": RelevanceModel,
-                    "template_type": "jinja2",
-                    "name": "Chat Product Relevance",
-                    "prompt_inputs": prompt_inputs_common,
-                },
-            ]
-
-            results = []
-
-            for prompt in prompts:
-                try:
-                    result = _call_structured_llm_wrapper(**prompt)
-                    results.append(_ensure_result_shape(result))
-                except Exception as e:
-                    logger.error(f"Error calling LLM for {prompt['name']}: {e}")
-                    results.append({"score": 0, "evidences": []})
-
-            currency_result, chat_topic_result, chat_product_result = results
-
-            return currency_result, chat_topic_result, chat_product_result
-        
-        currency_result, chat_topic_result, chat_product_result = _sequential_structured_llm_calls()
-
         output_dict["currency relevance"] = currency_result
         output_dict["chat topic relevance"] = chat_topic_result
         output_dict["chat product relevance"] = chat_product_result
@@ -136,27 +109,307 @@ def recsys_llm(client_profile: ClientProfile, candidates: List[Publication]):
     return output_df
 
 
+def recsys_llm(client_profile: ClientProfile, candidates: List[Publication]):
+
+    def _score(candidate_idx: int, prompt_idx: int):
+        name, prompt_function = RELEVANCE_PROMPTS[prompt_idx]
+        try:
+            result = call_structured_llm(prompt_template=prompt_function(),
+                                         prompt_inputs=prompt_inputs[candidate_idx],
+                                         template_type="jinja2",
+                                         output_schema=RelevanceModel)
+            return _ensure_result_shape(result)
+        except Exception as e:
+            logger.error(f"Error calling LLM for {name} of '{candidates[candidate_idx].title}': {e}")
+            return {"score": 0, "evidences": []}
+
+    # Fan out every (candidate x prompt) pair; results are written back by index so the order is deterministic
+    prompt_inputs = [_build_relevance_prompt_inputs(client_profile, candidate) for candidate in candidates]
+    results = [[{"score": 0, "evidences": []} for _ in RELEVANCE_PROMPTS] for _ in candidates]
+
+    with ThreadPoolExecutor(max_workers=settings.max_worker) as executor:
+        futures = {executor.submit(_score, candidate_idx, prompt_idx): (candidate_idx, prompt_idx)
+                   for candidate_idx in range(len(candidates))
+                   for prompt_idx in range(len(RELEVANCE_PROMPTS))}
+
+        for future in as_completed(futures):
+            candidate_idx, prompt_idx = futures[future]
+            results[candidate_idx][prompt_idx] = future.result()
+
+    return _build_recsys_output(candidates, results)
+
+
+async def arecsys_llm(client_profile: ClientProfile, candidates: List[Publication]):
+    """Async variant of recsys_llm; concurrency is capped by the global LLM limiter"""
+
+    async def _score(candidate: Publication, prompt_inputs: dict, name: str, prompt_function):
+        try:
+            result = await acall_structured_llm(prompt_template=prompt_function(),
+                                                prompt_inputs=prompt_inputs,
+                                                template_type="jinja2",
+                                                output_schema=RelevanceModel)
+            return _ensure_result_shape(result)
+        except Exception as e:
+            logger.error(f"Error calling LLM for {name} of '{candidate.title}': {e}")
+            return {"score": 0, "evidences": []}
+
+    prompt_inputs = [_build_relevance_prompt_inputs(client_profile, candidate) for candidate in candidates]
+    flat_results = await asyncio.gather(*[_score(candidate, candidate_inputs, name, prompt_function)
+                                          for candidate, candidate_inputs in zip(candidates, prompt_inputs)
+                                          for name, prompt_function in RELEVANCE_PROMPTS])
+
+    n_prompts = len(RELEVANCE_PROMPTS)
+    results = [list(flat_results[i:i + n_prompts]) for i in range(0, len(flat_results), n_prompts)]
+
+    return _build_recsys_output(candidates, results)
+
+
+HYBRID_SCORE_KEY = "hybrid_score"
+
+
+def _chunk_key(doc: Document) -> tuple:
+    return (doc.id,) if doc.id else (publication_key(doc.metadata), doc.page_content)
+
+
+def fuse_retrieval_hits(
+    retrieved_hits: List[List[Tuple[Document, float]]],
+    method: str = "rrf",
+    rrf_k: int = 60,
+) -> List[Tuple[Document, float, float]]:
+    """
+    Merge the per-query hits of recsys_rag_batch into one list of unique chunks.
+
+    method="rrf" scores a chunk by reciprocal rank fusion, sum(1 / (rrf_k + rank))
+    over the queries that retrieved it; method="max" by its best ranking score,
+    the hybrid score of metadata[HYBRID_SCORE_KEY] or else the relevance score.
+
+    Returns:
+        List[Tuple[Document, float, float]]: (chunk, fused score, best relevance score), best first
+    """
+    if method not in ("rrf", "max"):
+        raise ValueError(f"Unknown retrieval fusion method: {method}")
+
+    fused: dict = {}
+    for hits in retrieved_hits:
+        for rank, (doc, similarity) in enumerate(hits, start=1):
+            key = _chunk_key(doc)
+            score = 1.0 / (rrf_k + rank) if method == "rrf" else doc.metadata.get(HYBRID_SCORE_KEY, similarity)
+            if key not in fused:
+                fused[key] = [doc, score, similarity]
+                continue
+            entry = fused[key]
+            entry[1] = entry[1] + score if method == "rrf" else max(entry[1], score)
+            entry[2] = max(entry[2], similarity)
+
+    return sorted((tuple(entry) for entry in fused.values()), key=lambda entry: entry[1], reverse=True)
+
+
 def build_candidates_with_passages(
     query: str,
     documents: List,
     max_passages_per_pub: int = 3,
+    scores: Optional[List[float]] = None,
+    similarities: Optional[List[float]] = None,
+    publication_store=None,
 ) -> List[Candidate]:
+    """
+    Group retrieved chunks by publication into candidates of up to max_passages_per_pub passages.
+
+    Publications are hydrated from `publication_store` with one lookup for all
+    candidates, falling back to the chunk metadata of indexes built before the
+    store existed.
+
+    Without scores, passages keep the order of `documents`. With scores (e.g. the
+    fused scores of fuse_retrieval_hits), each publication keeps its highest
+    scoring passages, candidates are ranked by their best passage, and
+    Passage.score is the chunk's relevance score (`similarities`, or `scores`).
+    """
     grouped: dict[str, List] = {}
     for idx, doc in enumerate(documents):
-        pub_hash = doc.metadata.get("hash") or doc.metadata.get("publication_id") or f"nohash-{idx}"
-        grouped.setdefault(pub_hash, []).append((idx, doc))
+        pub_hash = publication_key(doc.metadata) or f"nohash-{idx}"
+        grouped.setdefault(pub_hash, []).append(idx)
+
+    if scores is None:
+        ranked_groups = [sorted(items)[:max_passages_per_pub] for items in grouped.values()]
+    else:
+        ranked_groups = [sorted(items, key=lambda i: (-scores[i], i))[:max_passages_per_pub] for items in grouped.values()]
+        ranked_groups.sort(key=lambda items: scores[items[0]], reverse=True)
+
+    passage_scores = similarities if similarities is not None else scores
+
+    records = publication_store.get_many(list(grouped)) if publication_store is not None else {}
 
     candidates: List[Candidate] = []
-    for _, items in grouped.items():
-        items_sorted = sorted(items, key=lambda x: x[0])[:max_passages_per_pub]
-        any_doc = items_sorted[0][1]
-        publication = Publication(**any_doc.metadata)
-        passages = [Passage(text=d.page_content, rank=i, score=None) for i, (_, d) in enumerate(items_sorted, start=1)]
+    for items in ranked_groups:
+        metadata = documents[items[0]].metadata
+        publication = Publication(**records.get(publication_key(metadata), metadata))
+        passages = [Passage(text=documents[i].page_content,
+                            rank=rank,
+                            score=passage_scores[i] if passage_scores is not None else None)
+                    for rank, i in enumerate(items, start=1)]
+        if scores is not None:
+            publication.metadata = {**(publication.metadata or {}),
+                                    "retrieval_score": scores[items[0]],
+                                    "retrieval_similarity": max(passage.score for passage in passages)}
         candidates.append(Candidate(publication=publication, passages=passages))
 
     return candidates
 
 
+_TERM_SEPARATORS = re.compile(r"[;,\n]+")
+_CURRENCY_PAIR = re.compile(r"([A-Z]{3})\s*([/\-])?\s*([A-Z]{3})")
+
+# ISO 4217 codes, plus the offshore renminbi and precious metals quoted as currencies
+ISO_CURRENCY_CODES = frozenset("""
+    AED AFN ALL AMD ANG AOA ARS AUD AWG AZN BAM BBD BDT BGN BHD BIF BMD BND BOB BRL BSD BTN BWP BYN BZD
+    CAD CDF CHF CLP CNH CNY COP CRC CUP CVE CZK DJF DKK DOP DZD EGP ERN ETB EUR FJD FKP GBP GEL GHS GIP
+    GMD GNF GTQ GYD HKD HNL HTG HUF IDR ILS INR IQD IRR ISK JMD JOD JPY KES KGS KHR KMF KPW KRW KWD KYD
+    KZT LAK LBP LKR LRD LSL LYD MAD MDL MGA MKD MMK MNT MOP MRU MUR MVR MWK MXN MYR MZN NAD NGN NIO NOK
+    NPR NZD OMR PAB PEN PGK PHP PKR PLN PYG QAR RON RSD RUB RWF SAR SBD SCR SDG SEK SGD SHP SLE SOS SRD
+    SSP STN SVC SYP SZL THB TJS TMT TND TOP TRY TTD TWD TZS UAH UGX USD UYU UZS VES VND VUV WST XAF XCD
+    XOF XPF YER ZAR ZMW ZWL XAU XAG XPT XPD
+""".split())
+
+
+def _profile_terms(value: Optional[str]) -> List[str]:
+    return [term.strip() for term in _TERM_SEPARATORS.split(value or "") if term.strip()]
+
+
+def _currency_pair(term: str) -> Optional[Tuple[str, str]]:
+    """(base, quote) of a term written with a separator, or of two ISO currency codes"""
+    pair = _CURRENCY_PAIR.fullmatch(term.upper())
+    if pair is None:
+        return None
+    base, separator, quote = pair.groups()
+    if separator or (base in ISO_CURRENCY_CODES and quote in ISO_CURRENCY_CODES):
+        return base, quote
+    return None
+
+
+def _singular(word: str) -> str:
+    lower = word.lower()
+    if len(word) > 4 and lower.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and lower.endswith(("ses", "xes", "ches", "shes")):
+        return word[:-2]
+    if len(word) > 3 and lower.endswith("s") and not lower.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _term_pattern(term: str) -> str:
+    """Whole-word pattern of a term, its last word singular or plural ("option(s)", "equit(y|ies)")"""
+    words = [re.escape(word) for word in term.split()]
+    last = _singular(term.split()[-1])
+    if len(last) > 2 and last[-1] in "yY" and last[-2].lower() not in "aeiou":
+        words[-1] = re.escape(last[:-1]) + r"(?:y|ies)"
+    else:
+        words[-1] = re.escape(last) + r"(?:e?s)?"
+    return r"(?<!\w)" + r"\s+".join(words) + r"(?!\w)"
+
+
+class LexicalMatcher:
+    """
+    Compiled, case-insensitive matcher of a client's currencies and products.
+
+    Currency terms that are pairs (USD/IDR, USD-IDR, or USDIDR when both legs are
+    ISO codes) match in either order and with any separator, and also match a
+    currency list field ("USD; IDR") holding both legs. Every other term matches
+    as whole words with flexible whitespace, singular or plural.
+    """
+
+    def __init__(self, terms: List[str], currency_terms: Optional[List[str]] = None):
+        self.pairs = set()
+        alternatives = set()
+        for term in currency_terms or []:
+            pair = _currency_pair(term)
+            if pair:
+                base, quote = pair
+                self.pairs.add((base, quote))
+                alternatives.update({rf"\b{base}\s*[/\-]?\s*{quote}\b", rf"\b{quote}\s*[/\-]?\s*{base}\b"})
+            else:
+                alternatives.add(_term_pattern(term))
+        alternatives.update(_term_pattern(term) for term in terms)
+
+        self.pattern = re.compile("|".join(sorted(alternatives, key=len, reverse=True)), re.IGNORECASE) if alternatives else None
+
+    def __bool__(self) -> bool:
+        return self.pattern is not None
+
+    def matches(self, candidate: Candidate) -> set:
+        publication = candidate.publication
+        fields = [publication.llm_extract_currencies, publication.currencies, publication.llm_extract_instruments, publication.title]
+        fields += [passage.text for passage in candidate.passages]
+        found = {re.sub(r"[\s/\-]+", "", match.upper()) for field in fields if field for match in self.pattern.findall(field)}
+
+        if self.pairs:
+            codes = set(re.findall(r"[A-Z]{3}", f"{publication.llm_extract_currencies or ''} {publication.currencies or ''}".upper()))
+            found.update(base + quote for base, quote in self.pairs if base in codes and quote in codes)
+        return found
+
+
+def lexical_prefilter_candidates(
+    client_profile: ClientProfile,
+    candidates: List[Candidate],
+    mode: str = "demote",
+) -> List[Candidate]:
+    """
+    Deterministic pre-ranker between recall and LLM precision scoring.
+
+    Candidates whose extracted currencies / instruments, title and passages share
+    no currency or product with the client are dropped (mode="drop") or moved
+    behind the matching ones (mode="demote"). Clients without currencies or
+    products, and mode="off", keep every candidate.
+    """
+    if mode not in ("drop", "demote", "off"):
+        raise ValueError(f"Unknown lexical prefilter mode: {mode}")
+
+    matcher = LexicalMatcher(_profile_terms(client_profile.chat_products),
+                             currency_terms=_profile_terms(client_profile.chat_currencies))
+    if mode == "off" or not matcher:
+        return candidates
+
+    matched, unmatched = [], []
+    for candidate in candidates:
+        matches = matcher.matches(candidate)
+        candidate.publication.metadata = {**(candidate.publication.metadata or {}), "lexical_matches": sorted(matches)}
+        (matched if matches else unmatched).append(candidate)
+
+    return matched if mode == "drop" else matched + unmatched
+
+
+def _empty_passage_precision_result() -> dict:
+    return {
+        "score": 0,
+        "relation_match": False,
+        "relation_confidence": 0.0,
+        "relation": {"instrument": "", "underlier": "", "tenor": "", "strategy": ""},
+        "evidences": [],
+        "passage_snippet": "",
+    }
+
+
+def _build_passage_precision_inputs(client_profile: ClientProfile, passage: Passage) -> dict:
+    return {
+        "client_chat_interest": client_profile.chat_interest,
+        "client_chat_products": client_profile.chat_products,
+        "client_chat_currencies": client_profile.chat_currencies,
+        "passage_text": passage.text,
+    }
+
+
+def select_best_passage_result(precision_results: List[dict]) -> dict:
+    # select best passage by score then relation_confidence
+    try:
+        return sorted(
+            precision_results,
+            key=lambda r: (int(r.get("score", 0)), float(r.get("relation_confidence", 0.0))),
+            reverse=True,
+        )[0]
+    except Exception:
+        return {"score": 0, "relation_confidence": 0.0}
+
+
 def score_passages_precision(
     client_profile: ClientProfile,
     candidate: Candidate,
@@ -165,12 +418,7 @@ def score_passages_precision(
     results: List[dict] = []
     prompt_template = get_passage_precision_prompt()
     for p in candidate.passages:
-        prompt_inputs = {
-            "client_chat_interest": client_profile.chat_interest,
-            "client_chat_products": client_profile.chat_products,
-            "client_chat_currencies": client_profile.chat_currencies,
-            "passage_text": p.text,
-        }
+        prompt_inputs = _build_passage_precision_inputs(client_profile, p)
         try:
             result = llm_caller(
                 prompt_template=prompt_template,
@@ -180,46 +428,413 @@ def score_passages_precision(
             )
         except Exception as e:
             logger.error(f"Passage precision scoring failed: {e}")
-            result = {
-                "score": 0,
-                "relation_match": False,
-                "relation_confidence": 0.0,
-                "relation": {"instrument": "", "underlier": "", "tenor": "", "strategy": ""},
-                "evidences": [],
-                "passage_snippet": "",
-            }
+            result = _empty_passage_precision_result()
         results.append(result)
     return results
 
 
+def _is_perfect_passage_result(result: dict) -> bool:
+    try:
+        return int(result.get("score", 0)) == 10 and float(result.get("relation_confidence", 0.0)) >= 1.0
+    except Exception:
+        return False
+
+
+def is_scored_precision_result(result: dict) -> bool:
+    """Whether a precision result came from an LLM answer, not from a failed or skipped call"""
+    return bool(result) and "relation_match" in result and result != _empty_passage_precision_result()
+
+
+precision_rate_limiter = RateLimiter(settings.llm_max_requests_per_second)
+
+
+def score_candidates_precision(
+    client_profile: ClientProfile,
+    candidates: List[Candidate],
+    llm_caller=call_structured_llm,
+    max_workers: Optional[int] = None,
+    max_requests_per_second: Optional[float] = None,
+) -> List[Candidate]:
+    """
+    Score every passage of every candidate concurrently and attach
+    `precision_best_passage` to each candidate's publication metadata.
+
+    Passages are scheduled by rank across candidates (all first passages, then
+    all second passages, ...) and calls are spaced by the process-wide
+    precision_rate_limiter, shared by every client scored concurrently, unless
+    `max_requests_per_second` asks for a limiter of this call's own.
+    Once a passage of a publication scores 10 with confidence 1.0, the passages
+    of that publication which have not started yet are skipped.
+    """
+    max_workers = settings.max_worker if max_workers is None else max_workers
+
+    prompt_template = get_passage_precision_prompt()
+    rate_limiter = precision_rate_limiter if max_requests_per_second is None else RateLimiter(max_requests_per_second)
+    resolved = [threading.Event() for _ in candidates]
+    results: List[List[dict]] = [[] for _ in candidates]
+    skipped = 0
+
+    def _score(candidate_idx: int, passage: Passage) -> Optional[dict]:
+        if resolved[candidate_idx].is_set():
+            return None
+        rate_limiter.acquire()
+        try:
+            result = llm_caller(
+                prompt_template=prompt_template,
+                prompt_inputs=_build_passage_precision_inputs(client_profile, passage),
+                template_type="jinja2",
+                output_schema=PassagePrecisionModel,
+            )
+        except Exception as e:
+            logger.error(f"Passage precision scoring failed: {e}")
+            result = _empty_passage_precision_result()
+        if _is_perfect_passage_result(result):
+            resolved[candidate_idx].set()
+        return result
+
+    jobs = sorted(
+        ((passage_idx, candidate_idx, passage)
+         for candidate_idx, candidate in enumerate(candidates)
+         for passage_idx, passage in enumerate(candidate.passages)),
+        key=lambda job: (job[0], job[1]),
+    )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_score, candidate_idx, passage): (candidate_idx, passage_idx)
+                   for passage_idx, candidate_idx, passage in jobs}
+
+        passage_results: dict = {}
+        for future in as_completed(futures):
+            result = future.result()
+            if result is None:
+                skipped += 1
+                continue
+            passage_results[futures[future]] = result
+
+    for (candidate_idx, _), result in sorted(passage_results.items()):
+        results[candidate_idx].append(result)
+
+    for candidate, precision_results in zip(candidates, results):
+        candidate.publication.metadata = (candidate.publication.metadata or {})
+        candidate.publication.metadata.update({
+            "precision_best_passage": select_best_passage_result(precision_results),
+        })
+
+    logger.info(f"Passage precision scored {len(passage_results)} passages of {len(candidates)} candidates "
+                f"({skipped} skipped by short-circuit)")
+
+    return candidates
+
+
+async def ascore_candidates_precision(
+    client_profile: ClientProfile,
+    candidates: List[Candidate],
+    llm_caller=acall_structured_llm,
+) -> List[Candidate]:
+    """
+    Async variant of score_candidates_precision.
+
+    In-flight requests are capped by the global LLM limiter inside llm_caller.
+    Passages are awaited rank by rank, so a publication whose earlier passage
+    scored 10 with confidence 1.0 does not send its remaining passages.
+    """
+    prompt_template = get_passage_precision_prompt()
+    results: List[List[dict]] = [[] for _ in candidates]
+    resolved = [False for _ in candidates]
+    skipped = 0
+
+    async def _score(passage: Passage) -> dict:
+        try:
+            return await llm_caller(
+                prompt_template=prompt_template,
+                prompt_inputs=_build_passage_precision_inputs(client_profile, passage),
+                template_type="jinja2",
+                output_schema=PassagePrecisionModel,
+            )
+        except Exception as e:
+            logger.error(f"Passage precision scoring failed: {e}")
+            return _empty_passage_precision_result()
+
+    max_passages = max((len(candidate.passages) for candidate in candidates), default=0)
+    for passage_idx in range(max_passages):
+        jobs = []
+        for candidate_idx, candidate in enumerate(candidates):
+            if passage_idx >= len(candidate.passages):
+                continue
+            if resolved[candidate_idx]:
+                skipped += 1
+                continue
+            jobs.append((candidate_idx, candidate.passages[passage_idx]))
+
+        rank_results = await asyncio.gather(*[_score(passage) for _, passage in jobs])
+        for (candidate_idx, _), result in zip(jobs, rank_results):
+            results[candidate_idx].append(result)
+            if _is_perfect_passage_result(result):
+                resolved[candidate_idx] = True
+
+    for candidate, precision_results in zip(candidates, results):
+        candidate.publication.metadata = (candidate.publication.metadata or {})
+        candidate.publication.metadata.update({
+            "precision_best_passage": select_best_passage_result(precision_results),
+        })
+
+    logger.info(f"Passage precision scored {sum(len(r) for r in results)} passages of {len(candidates)} candidates "
+                f"({skipped} skipped by short-circuit)")
+
+    return candidates
+
+
+PRECISION_DTYPE = np.dtype([
+    ("publication_id", object),
+    ("score", np.int16),
+    ("confidence", np.float32),
+    ("relation_match", np.bool_),
+    ("similarity", np.float32),
+])
+
+
+def _as_number(value, cast, default):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def build_precision_table(publications: List[Publication]) -> np.ndarray:
+    """
+    One PRECISION_DTYPE row per publication, read from metadata["precision_best_passage"].
+
+    `similarity` is metadata["retrieval_similarity"] when retrieval recorded it, NaN otherwise.
+    """
+    table = np.empty(len(publications), dtype=PRECISION_DTYPE)
+    ids, scores, confidences, relation_matches, similarities = [], [], [], [], []
+    for pub in publications:
+        meta = pub.metadata or {}
+        best = meta.get("precision_best_passage") or {}
+        ids.append(pub.hash or pub.publication_id)
+        scores.append(_as_number(best.get("score", 0), int, 0))
+        confidences.append(_as_number(best.get("relation_confidence", 0.0), float, 0.0))
+        relation_matches.append(bool(best.get("relation_match", False)))
+        similarities.append(_as_number(meta.get("retrieval_similarity", np.nan), float, np.nan))
+
+    table["publication_id"] = ids
+    table["score"] = scores
+    table["confidence"] = confidences
+    table["relation_match"] = relation_matches
+    table["similarity"] = similarities
+    return table
+
+
+def select_top_precision(table: np.ndarray,
+                         min_score: int,
+                         min_confidence: float,
+                         top_n: Optional[int] = None) -> np.ndarray:
+    """
+    Indices of the rows that pass the precision thresholds, best first.
+
+    Rows are ranked by score, then confidence, then retrieval similarity, ties
+    keeping their input order. With top_n, argpartition on the score bounds the
+    rows that need a full sort to those at or above the top_n-th score.
+    """
+    kept = np.flatnonzero(table["relation_match"] & (table["score"] >= min_score) & (table["confidence"] >= min_confidence))
+
+    if top_n and len(kept) > top_n:
+        scores = table["score"][kept]
+        kth_score = scores[np.argpartition(-scores, top_n - 1)[:top_n]].min()
+        kept = kept[scores >= kth_score]
+
+    similarity = np.nan_to_num(table["similarity"][kept], nan=-np.inf)
+    order = np.lexsort((kept, -similarity, -table["confidence"][kept], -table["score"][kept]))
+    ranked = kept[order]
+    return ranked[:top_n] if top_n else ranked
+
 
 def recsys_rag(
     query: str,
     embedding_folder_path: str,
     publication_file_path: str,
     top_k: int = 10,
+    recommendation_date=None,
 ):
-    embeddings = AzureOpenAIEmbeddings(
-        azure_endpoint=settings.azure_openai_embeddings_endpoint,
-        azure_deployment=settings.azure_openai_embeddings_deployment_name,
-        openai_api_version=settings.azure_openai_embeddings_api_version,
-        openai_api_key=settings.azure_openai_embeddings_api_key,
-    )
+    hits = recsys_rag_batch([query], embedding_folder_path, publication_file_path, top_k=top_k,
+                            recommendation_date=recommendation_date)[0]
+    return [doc for doc, _ in hits]
 
-    if os.path.exists(embedding_folder_path):
-        vectorstore = FAISS.load_local(
-            embedding_folder_path,
-            embeddings=embeddings,
-            allow_dangerous_deserialization=True,
-        )
+
+def retrieval_filter_mask(publication_index, vectorstore, recommendation_date=None) -> Optional[np.ndarray]:
+    """
+    FAISS positions of `vectorstore` passing the settings.retrieval_* metadata
+    filter: published in the retrieval_lookback_days days up to and including
+    recommendation_date, in retrieval_regions and retrieval_asset_classes.
+
+    Returns:
+        Optional[np.ndarray]: Bool mask over the positions, None when nothing is filtered out
+    """
+    start_day, end_day = None, None
+    if recommendation_date and settings.retrieval_lookback_days > 0:
+        end_day = day_number(recommendation_date)
+        start_day = end_day - settings.retrieval_lookback_days + 1
+
+    tag_values = {"region": settings.retrieval_regions, "asset_class": settings.retrieval_asset_classes}
+    if start_day is None and not any(tag_values.values()):
+        return None
+
+    allowed = publication_index.metadata(vectorstore).allowed(start_day, end_day, tag_values)
+    logger.info(f"[PublicationIndex] Metadata filter keeps {int(allowed.sum())} of {len(allowed)} chunks")
+    return None if allowed.all() else allowed
+
+
+def _dense_search(vectorstore, query_matrix: np.ndarray, top_k: int, allowed: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+    if faiss_normalizes_l2(vectorstore):
+        faiss.normalize_L2(query_matrix)
+
+    if allowed is None:
+        scores, indices = vectorstore.index.search(query_matrix, top_k)
     else:
-        doc_df = pd.read_json(publication_file_path)
-        doc_df = publication_feature_extraction(doc_df)
-        documents = publication_preprocessing(doc_df)
-        vectorstore = FAISS.from_documents(documents, embeddings=embeddings)
-        os.makedirs(embedding_folder_path, exist_ok=True)
-        vectorstore.save_local(embedding_folder_path)
-
-    retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": top_k})
-    relevant_documents = retriever.invoke(query)
-    return relevant_documents
+        bitmap = np.packbits(allowed, bitorder="little")
+        try:
+            params = selector_search_parameters(vectorstore.index, faiss.IDSelectorBitmap(bitmap))
+            scores, indices = vectorstore.index.search(query_matrix, top_k, params=params)
+        except RuntimeError:
+            # index types without ID selector support (e.g. plain PQ) are filtered after the search
+            logger.warning(f"[PublicationIndex] {type(vectorstore.index).__name__} does not support ID selectors, filtering the hits")
+            scores, indices = vectorstore.index.search(query_matrix, top_k)
+            indices = np.where(allowed[np.maximum(indices, 0)], indices, -1)
+    relevance_score_fn = faiss_relevance_score_fn(vectorstore)
+
+    return [[(int(i), float(relevance_score_fn(float(score)))) for score, i in zip(query_scores, query_indices) if i != -1]
+            for query_scores, query_indices in zip(scores, indices)]
+
+
+def _hits_to_documents(vectorstore,
+                       hits: List[Tuple[int, float]],
+                       hybrid_scores: Optional[dict] = None) -> List[Tuple[Document, float]]:
+    documents = []
+    for i, score in hits:
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+        if not isinstance(doc, Document):
+            continue
+        if hybrid_scores is not None:
+            # a copy, so the docstore's chunk never carries the score of one query
+            doc = Document(id=doc.id, page_content=doc.page_content, metadata={**doc.metadata, HYBRID_SCORE_KEY: hybrid_scores[i]})
+        documents.append((doc, score))
+    return documents
+
+
+def _min_max_normalize(hits: List[Tuple[int, float]]) -> dict:
+    if not hits:
+        return {}
+    scores = np.array([score for _, score in hits], dtype=np.float64)
+    low, high = scores.min(), scores.max()
+    normalized = (scores - low) / (high - low) if high > low else np.ones_like(scores)
+    return {i: float(score) for (i, _), score in zip(hits, normalized)}
+
+
+def merge_hybrid_hits(
+    dense_hits: List[Tuple[int, float]],
+    bm25_hits: List[Tuple[int, float]],
+    top_k: int,
+    dense_weight: float,
+    bm25_weight: float,
+) -> List[Tuple[int, float]]:
+    """
+    Weighted sum of the min-max normalized dense and BM25 scores of one query.
+
+    Returns:
+        List[Tuple[int, float]]: Top `top_k` (FAISS position, hybrid score in [0, 1]), best first
+    """
+    total_weight = dense_weight + bm25_weight
+    combined: dict = {}
+    for hits, weight in ((dense_hits, dense_weight), (bm25_hits, bm25_weight)):
+        for i, score in _min_max_normalize(hits).items():
+            combined[i] = combined.get(i, 0.0) + weight * score / total_weight
+
+    return sorted(combined.items(), key=lambda hit: hit[1], reverse=True)[:top_k]
+
+
+def _search_publications(publication_index,
+                         vectorstore,
+                         queries: List[str],
+                         query_matrix: np.ndarray,
+                         top_k: int,
+                         recommendation_date=None) -> List[List[Tuple[Document, float]]]:
+    allowed = retrieval_filter_mask(publication_index, vectorstore, recommendation_date)
+    if allowed is not None and not allowed.any():
+        return [[] for _ in queries]
+
+    hits = _dense_search(vectorstore, query_matrix, top_k, allowed)
+
+    bm25 = publication_index.bm25() if settings.hybrid_bm25_weight > 0 else None
+    if bm25 is not None and not bm25.matches(vectorstore):
+        logger.warning("[PublicationIndex] Index reloaded during the search, using dense hits only")
+        bm25 = None
+
+    if bm25 is None:
+        return [_hits_to_documents(vectorstore, query_hits) for query_hits in hits]
+
+    # ranked by the hybrid score, which the chunks carry in metadata[HYBRID_SCORE_KEY];
+    # the returned similarity stays the dense relevance score, 0 for BM25-only hits
+    documents = []
+    for query, dense_hits in zip(queries, hits):
+        hybrid_hits = merge_hybrid_hits(dense_hits,
+                                        bm25.search(query, top_k, allowed),
+                                        top_k,
+                                        dense_weight=settings.hybrid_dense_weight,
+                                        bm25_weight=settings.hybrid_bm25_weight)
+        similarities = dict(dense_hits)
+        documents.append(_hits_to_documents(vectorstore,
+                                            [(i, similarities.get(i, 0.0)) for i, _ in hybrid_hits],
+                                            hybrid_scores=dict(hybrid_hits)))
+    return documents
+
+
+def recsys_rag_batch(
+    queries: List[str],
+    embedding_folder_path: str,
+    publication_file_path: str,
+    top_k: int = 10,
+    recommendation_date=None,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Retrieve the top_k chunks for several queries with one embeddings request
+    and one FAISS search over the stacked query matrix, merged with the BM25
+    hits of each query when settings.hybrid_bm25_weight is positive. Only the
+    chunks passing retrieval_filter_mask for `recommendation_date` are searched.
+
+    Returns:
+        List[List[Tuple[Document, float]]]: Per-query hits ranked best first,
+        with the vectorstore's relevance score (higher is more similar, 0 for
+        BM25-only hits). When BM25 is enabled the ranking follows the hybrid
+        score in [0, 1], kept in each chunk's metadata[HYBRID_SCORE_KEY].
+    """
+    if not queries:
+        return []
+
+    publication_index = get_publication_index(embedding_folder_path, publication_file_path)
+    vectorstore = publication_index.get()
+
+    query_matrix = np.asarray(publication_index.embeddings.embed_documents(list(queries)), dtype=np.float32)
+
+    return _search_publications(publication_index, vectorstore, list(queries), query_matrix, top_k, recommendation_date)
+
+
+async def arecsys_rag_batch(
+    queries: List[str],
+    embedding_folder_path: str,
+    publication_file_path: str,
+    top_k: int = 10,
+    recommendation_date=None,
+) -> List[List[Tuple[Document, float]]]:
+    """Async variant of recsys_rag_batch; the index loads and searches run in a worker thread"""
+    if not queries:
+        return []
+
+    publication_index = get_publication_index(embedding_folder_path, publication_file_path)
+    vectorstore = await asyncio.to_thread(publication_index.get)
+
+    async with llm_concurrency_limiter():
+        query_embeddings = await publication_index.embeddings.aembed_documents(list(queries))
+    query_matrix = np.asarray(query_embeddings, dtype=np.float32)
+
+    return await asyncio.to_thread(_search_publications, publication_index, vectorstore, list(queries), query_matrix, top_k,
+                                   recommendation_date)
@@ -3,6 +3,7 @@ from typing import List, Optional, Literal
 
 
 class ClientProfile(BaseModel):
+    client_id: Optional[str] = ""
     country: Optional[str] = ""
     company_name: Optional[str] = ""
     sector: Optional[str] = ""
@@ -58,6 +59,13 @@ class Publication(BaseModel):
     hash                    : Optional[str] = ""
 
 
+class PublicationMetadataModel(BaseModel):
+    topics: List[str] = Field(description="Topics of the article. Maximum 10")
+    keywords: List[str] = Field(description="Key phrases of the article, without currencies. Maximum 10")
+    currencies: List[str] = Field(description="Currency acronyms of the article (e.g. JPY, USD). Maximum 10")
+    instruments: List[str] = Field(description="Financial instruments discussed in the article. Maximum 10")
+
+
 class RelevanceModel(BaseModel):
     score: Literal[0, 5, 10] = Field(description="Relevance score. Choose one score amongst 0, 5, 10")
     evidences: List[str] = Field(description="Evidences")
@@ -1,56 +1,192 @@
+import os
+import time
+import asyncio
+import contextvars
+import pandas as pd
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Set
 from loguru import logger
 
 from settings import settings
 from utils import load_yaml_file
 from recsys import Market360Recsys
 from custom_types import ClientInput
+from cores.llm_functions import llm_request_budget
+from cores.embedding_functions import get_embedding_service
+from cores.index_functions import get_publication_index, get_chat_embedding_index
 
 
 CLIENTS = load_yaml_file(settings.clients_file_path)
 
+# Worker-thread futures started by the current client attempt
+_attempt_futures: contextvars.ContextVar[Optional[Set[Future]]] = contextvars.ContextVar("attempt_futures", default=None)
+
+
+class AttemptTrackingExecutor(ThreadPoolExecutor):
+    """
+    Default executor of the pipeline loop. Records the asyncio.to_thread work
+    of each client attempt, which keeps running after the attempt times out.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = super().submit(fn, *args, **kwargs)
+        futures = _attempt_futures.get()
+        if futures is not None:
+            futures.add(future)
+        return future
+
 
 class RecommendationPipeline:
     def __init__(self, recommendation_date: int) -> None:
         self.recommendation_date = recommendation_date
 
-    def recommend(self):
+    async def _recommend_client(self, recommender: Market360Recsys, client_input: ClientInput):
+        log_title = f"[Recommendation][{client_input.company}]"
+
+        recommendations = await recommender.arecommend(client=client_input)
+
+        logger.info(f"{log_title} Generating report")
+        report_html = await asyncio.to_thread(recommender.generate_reports, client=client_input, recommendations=recommendations)
+        logger.success(f"{log_title} Report generated")
+
+        # prepare email template
+        logger.info(f"{log_title} Preparing email template")
+        email_template = await asyncio.to_thread(recommender.send_email, client=client_input, recommendations=recommendations)
+        logger.success(f"{log_title} Email template prepared")
+
+        return recommendations
+
+    async def _run_client(self, recommender: Market360Recsys, client_input: ClientInput, semaphore: asyncio.Semaphore, summary: dict):
+        log_title = f"[Recommendation][{client_input.company}]"
+
+        async with semaphore:
+            summary["attempts"] += 1
+
+            if llm_request_budget.exhausted:
+                summary["status"] = "skipped"
+                summary["error"] = "LLM request budget exhausted"
+                logger.warning(f"{log_title} Skipped, LLM request budget exhausted")
+                return
+
+            logger.info(f"{log_title} Recommend for client (attempt {summary['attempts']})")
+            start = time.perf_counter()
+            futures = set()
+            _attempt_futures.set(futures)
+            try:
+                await asyncio.wait_for(self._recommend_client(recommender, client_input),
+                                       timeout=settings.pipeline_client_timeout_seconds)
+                summary["status"] = "partial" if llm_request_budget.exhausted else "success"
+                summary["error"] = "LLM request budget exhausted" if llm_request_budget.exhausted else ""
+            except asyncio.TimeoutError:
+                summary["status"] = "timeout"
+                summary["error"] = f"Timed out after {settings.pipeline_client_timeout_seconds}s"
+                logger.error(f"{log_title} {summary['error']}")
+            except Exception as e:
+                summary["status"] = "failed"
+                summary["error"] = str(e)
+                logger.error(f"{log_title} Error: {e}")
+            finally:
+                # A timed-out or failed attempt leaves its worker threads running; the
+                # client is only retried, or its slot released, once they are done
+                running = [future for future in futures if not future.done()]
+                if running:
+                    logger.warning(f"{log_title} Waiting for {len(running)} worker thread(s) of the abandoned attempt")
+                    await asyncio.wait([asyncio.wrap_future(future) for future in running])
+                summary["wall_time_seconds"] += time.perf_counter() - start
+
+    async def arecommend(self):
+        """
+        Run clients concurrently, at most settings.pipeline_max_concurrent_clients at a time.
+
+        One client's failure or timeout never stops the run. Failed and timed-out
+        clients are queued for up to settings.pipeline_max_retries more attempts,
+        each once the worker threads of its previous attempt have finished.
+        """
         log_title = "[Recommendation]"
 
         logger.info(f"{log_title} Start")
 
+        asyncio.get_running_loop().set_default_executor(AttemptTrackingExecutor())
+
         recommender = Market360Recsys(recommendation_date=self.recommendation_date)
 
+        # Append the publications published since the last run before any client is served
+        try:
+            n_ingested = await asyncio.to_thread(get_publication_index().ingest)
+            logger.info(f"{log_title} Ingested {n_ingested} new publications")
+        except Exception as e:
+            logger.error(f"{log_title} Publication ingestion failed, serving the existing index: {e}")
+
+        # Chats that fell out of the coverage window are never searched again
+        try:
+            chat_cutoff = pd.Timestamp(str(self.recommendation_date)) - pd.Timedelta(days=settings.bbg_chat_coverage_day_range)
+            await asyncio.to_thread(get_chat_embedding_index().prune, chat_cutoff)
+        except Exception as e:
+            logger.error(f"{log_title} Chat embedding pruning failed: {e}")
+
         client_inputs = [ClientInput(**client) for client in CLIENTS if client['added_to_pipeline'] and client['schedule_region'] == settings.schedule_region]
 
-        for client_input in client_inputs:
-            logger.info(f"{log_title} Recommend for client {client_input.client_id}")
+        semaphore = asyncio.Semaphore(settings.pipeline_max_concurrent_clients)
+        summaries = [{"client": client_input.company,
+                      "status": "pending",
+                      "attempts": 0,
+                      "wall_time_seconds": 0.0,
+                      "error": ""} for client_input in client_inputs]
 
-            try:
-                recommendations = recommender.recommend(client=client_input)
+        queue = list(range(len(client_inputs)))
+        for attempt in range(settings.pipeline_max_retries + 1):
+            if not queue:
+                break
+            if attempt:
+                logger.info(f"{log_title} Retrying {len(queue)} client(s)")
 
-                logger.info(f"{log_title} Generating report")
-                report_html = recommender.generate_reports(client=client_input, recommendations=recommendations)
-                logger.success(f"{log_title} Report generated")
+            await asyncio.gather(*[self._run_client(recommender, client_inputs[i], semaphore, summaries[i]) for i in queue])
 
-                # prepare email template
-                logger.info(f"{log_title} Preparing email template")
-                email_template = recommender.send_email(client=client_input, recommendations=recommendations)
-                logger.success(f"{log_title} Email template prepared")
+            queue = [i for i in queue if summaries[i]["status"] in ("failed", "timeout")]
 
-            except Exception as e:
-                logger.error(f"{log_title} Error: {e}")
-                continue
+        try:
+            await asyncio.to_thread(get_chat_embedding_index().flush)
+            logger.info(f"{log_title} Chat embeddings: {get_chat_embedding_index().stats()}")
+        except Exception as e:
+            logger.error(f"{log_title} Error saving chat embeddings: {e}")
+
+        embedding_stats = get_embedding_service().stats()
+        logger.info(f"{log_title} Embeddings: {embedding_stats['requested_texts']} texts requested, "
+                    f"{embedding_stats['embedded_texts']} embedded in {embedding_stats['batches']} batches, "
+                    f"hit rate {embedding_stats['hit_rate']:.1%}, ~{embedding_stats['tokens_saved_estimate']} tokens saved")
+
+        self._write_run_summary(summaries)
 
         logger.success(f"{log_title} Recommendation DONE!")
 
+        return summaries
+
+    def recommend(self):
+        return asyncio.run(self.arecommend())
+
+    def _write_run_summary(self, summaries: list):
+        log_title = "[Recommendation]"
+
+        try:
+            summary_df = pd.DataFrame(summaries, columns=["client", "status", "attempts", "wall_time_seconds", "error"])
+            summary_file_path = settings.run_summary_file_path.format(date=self.recommendation_date)
+            os.makedirs(os.path.dirname(summary_file_path) or ".", exist_ok=True)
+            summary_df.to_csv(summary_file_path, index=False)
+
+            status_counts = summary_df["status"].value_counts().to_dict()
+            logger.success(f"{log_title} Run summary saved to {summary_file_path}: {status_counts}, "
+                           f"{llm_request_budget.used} LLM requests")
+        except Exception as e:
+            logger.error(f"{log_title} Error writing run summary: {e}")
+
 
 if __name__ == "__main__":
     import optparse
 
-    option_parser = optparse.OptonParser()
+    option_parser = optparse.OptionParser()
     option_parser.add_option("-d", "--date", dest="recommendation_date", default="20250822")
 
     options, args = option_parser.parse_args()
 
     pipeline = RecommendationPipeline(recommendation_date=options.recommendation_date)
-    pipeline.recommend()
\ No newline at end of file
+    pipeline.recommend()
@@ -77,3 +77,18 @@ def generate_instruments_prompt():
         "output_format": "List of instruments separated by semi-colon"
     }"""
 
+
+def generate_publication_metadata_prompt():
+    return """{
+        "task": "Extract the topics, key phrases, currencies and financial instruments of the provided article_content without explanation.",
+        "fields": {
+            "topics": "Up to 10 topics, in the same language as the article_content.",
+            "keywords": "Up to 10 key phrases. DO NOT include currencies (e.g. JPY, USD). DO NOT REPEAT the same key phrase twice.",
+            "currencies": "Up to 10 main currency acronyms (e.g. JPY, USD, EUR). Infer the acronym from context if it is not explicit. Empty list if none.",
+            "instruments": "Up to 10 financial instruments explicitly discussed (e.g. options, swaps, CDS, futures, forwards, spot, convertible bonds, ELN, ETFs). Prefer instrument types over generic words like 'derivatives'. Do not include currencies. Empty list if none."
+        },
+        "notes": [
+            "Every item must be derived from the article_content. NEVER hallucinate!"
+        ],
+        "article_content": "{{ article_content }}"
+    }"""
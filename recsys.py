@@ -1,7 +1,8 @@
 import copy
+import asyncio
 import pandas as pd
 from loguru import logger
-from typing import Optional
+from typing import List, Optional, Tuple
 from functools import partial
 from collections import defaultdict
 from custom_types import ClientInput
@@ -10,9 +11,24 @@ from concurrent.futures import as_completed, ThreadPoolExecutor
 from settings import settings
 
 from custom_types import *
-from cores.llm_functions import call_structured_llm
-from cores.chat_functions import chat_feature_extraction
-from cores.recsys_functions import recsys_llm, recsys_rag, build_candidates_with_passages, score_passages_precision
+from cores.llm_functions import call_structured_llm, acall_structured_llm
+from cores.chat_functions import chat_feature_extraction, achat_feature_extraction, get_chat_store
+from cores.index_functions import get_publication_index, get_chat_embedding_index
+from cores.archive_functions import archive_client_id, archive_date, get_recommendation_archive
+from cores.recsys_functions import (
+    recsys_llm,
+    arecsys_llm,
+    recsys_rag_batch,
+    arecsys_rag_batch,
+    fuse_retrieval_hits,
+    lexical_prefilter_candidates,
+    build_candidates_with_passages,
+    score_candidates_precision,
+    ascore_candidates_precision,
+    build_precision_table,
+    select_top_precision,
+    is_scored_precision_result,
+)
 from prompts.recsys import (
     get_queries_from_chat_interest_prompt,
     get_queries_from_chat_summary_prompt,
@@ -25,21 +41,30 @@ class Market360Recsys:
     def __init__(self, recommendation_date):
         self.recommendation_date = recommendation_date
 
-    @staticmethod
-    def _prepare_bbg_chat_data():
-        return pd.read_csv(settings.bbg_chat_file_path)
-
-    def _generate_candidates(self, client_profile: ClientProfile, recommendation_date: int) -> List[Publication]:
+    def _prepare_bbg_chat_data(self,
+                               client: ClientInput,
+                               recommendation_date: Optional[int] = None,
+                               bbg_chat_coverage_day_range: Optional[int] = None) -> pd.DataFrame:
         recommendation_date = recommendation_date or self.recommendation_date
+        bbg_chat_coverage_day_range = bbg_chat_coverage_day_range or settings.bbg_chat_coverage_day_range
+
+        # the chat store is parsed once per process and shared by every client
+        return get_chat_store(settings.bbg_chat_file_path).get_client_chats(
+            company_names=client.bbg_chat_company_names or [client.company],
+            sales_names=client.bbg_chat_sales_names,
+            end_date=recommendation_date,
+            day_range=bbg_chat_coverage_day_range,
+        )
 
-        hash_archive = set()
-
-        def _post_process_query_generation_result(result, **kwargs):
-            try:
-                return [_q.get("query", "") for _q in result.get("queries", []) if _q.get("query", "")]
-            except Exception:
-                return []
+    @staticmethod
+    def _post_process_query_generation_result(result, **kwargs):
+        try:
+            return [_q.get("query", "") for _q in result.get("queries", []) if _q.get("query", "")]
+        except Exception:
+            return []
 
+    @staticmethod
+    def _query_generation_requests(client_profile: ClientProfile) -> dict:
         default_input_parameters = {"chat_interest"      : None,
                                     "chat_summary"       : None,
                                     "chat_products"      : None,
@@ -55,45 +80,193 @@ class Market360Recsys:
         chat_summary_input_template["chat_summary"]       = client_profile.chat_summary
         chat_products_input_template["chat_products"]     = client_profile.chat_products
         chat_currencies_input_template["chat_currencies"] = client_profile.chat_currencies
-        
-        call_llm_query_chat_interest_template = partial(call_structured_llm, 
-                                                        output_schema=GeneratedQueries, 
-                                                        template_type="jinja2",
-                                                        prompt_inputs=chat_interest_input_template,
-                                                        prompt_template=get_queries_from_chat_interest_prompt())
-
-        call_llm_query_chat_summary_template = partial(call_structured_llm, 
-                                                        output_schema=GeneratedQueries, 
-                                                        template_type="jinja2",
-                                                        prompt_inputs=chat_summary_input_template,
-                                                        prompt_template=get_queries_from_chat_summary_prompt())
-        
-        call_llm_query_chat_products_template = partial(call_structured_llm, 
-                                                        output_schema=GeneratedQueries, 
-                                                        template_type="jinja2",
-                                                        prompt_inputs=chat_products_input_template,
-                                                        prompt_template=get_queries_from_chat_products_prompt())
-        
-        call_llm_query_chat_currencies_template = partial(call_structured_llm, 
-                                                        output_schema=GeneratedQueries, 
-                                                        template_type="jinja2",
-                                                        prompt_inputs=chat_currencies_input_template,
-                                                        prompt_template=get_queries_from_chat_currencies_prompt())
-        
+
+        return {
+            "chat_interest": dict(output_schema=GeneratedQueries,
+                                  template_type="jinja2",
+                                  prompt_inputs=chat_interest_input_template,
+                                  prompt_template=get_queries_from_chat_interest_prompt()),
+            "chat_summary": dict(output_schema=GeneratedQueries,
+                                 template_type="jinja2",
+                                 prompt_inputs=chat_summary_input_template,
+                                 prompt_template=get_queries_from_chat_summary_prompt()),
+            "chat_products": dict(output_schema=GeneratedQueries,
+                                  template_type="jinja2",
+                                  prompt_inputs=chat_products_input_template,
+                                  prompt_template=get_queries_from_chat_products_prompt()),
+            "chat_currencies": dict(output_schema=GeneratedQueries,
+                                    template_type="jinja2",
+                                    prompt_inputs=chat_currencies_input_template,
+                                    prompt_template=get_queries_from_chat_currencies_prompt()),
+        }
+
+    def _build_passage_candidates(self,
+                                  client_profile: ClientProfile,
+                                  queries: List[str],
+                                  retrieved_hits: list,
+                                  archived: Optional[dict] = None,
+                                  recommendation_date=None) -> Tuple[List[Candidate], List[Candidate]]:
+        """
+        Fuse the per-query hits, group them into publication candidates ranked by
+        their best passage, set aside the ones the archive drops or reuses, drop or
+        demote the lexical non-matches, and keep the settings.candidate_pool_size
+        strongest ones for the LLM precision stage.
+
+        Returns:
+            Tuple[List[Candidate], List[Candidate]]: Candidates to score, candidates reusing their archived score
+        """
+        fused_hits = fuse_retrieval_hits(retrieved_hits,
+                                         method=settings.retrieval_fusion_method,
+                                         rrf_k=settings.retrieval_rrf_k)
+
+        passage_candidates = build_candidates_with_passages(query=" ".join(queries),
+                                                            documents=[doc for doc, _, _ in fused_hits],
+                                                            max_passages_per_pub=3,
+                                                            scores=[score for _, score, _ in fused_hits],
+                                                            similarities=[similarity for _, _, similarity in fused_hits],
+                                                            publication_store=get_publication_index(settings.embedding_folder_path,
+                                                                                                    settings.publication_file_path).publications)
+
+        # archived publications are set aside before the cap, so they never take the slots of new ones
+        reused_candidates = []
+        if archived:
+            passage_candidates, reused_candidates = self._split_archived_candidates(client_profile, passage_candidates, archived,
+                                                                                    recommendation_date)
+
+        def _cap(candidates: List[Candidate]) -> List[Candidate]:
+            return candidates[:settings.candidate_pool_size] if settings.candidate_pool_size else candidates
+
+        n_recalled = len(passage_candidates)
+        baseline_calls = sum(len(candidate.passages) for candidate in _cap(passage_candidates))
+
+        passage_candidates = _cap(lexical_prefilter_candidates(client_profile, passage_candidates, mode=settings.lexical_prefilter_mode))
+
+        saved_calls = baseline_calls - sum(len(candidate.passages) for candidate in passage_candidates)
+        logger.info(f"[{client_profile.company_name}] {len(passage_candidates)} of {n_recalled} recalled publications "
+                    f"sent to precision scoring, lexical prefilter saved {saved_calls} LLM calls")
+
+        return passage_candidates, reused_candidates
+
+    @staticmethod
+    def _archived_entries(client_profile: ClientProfile, recommendation_date) -> dict:
+        archive = get_recommendation_archive()
+        if archive is None:
+            return {}
+        return archive.recent(client_profile.client_id, recommendation_date, settings.recommendation_archive_day_range)
+
+    @staticmethod
+    def _split_archived_candidates(client_profile: ClientProfile,
+                                   passage_candidates: List[Candidate],
+                                   archived: dict,
+                                   recommendation_date) -> Tuple[List[Candidate], List[Candidate]]:
+        """
+        Split the candidates into the ones to score and the ones reusing their
+        archived precision score. Publications recommended to the client on an
+        earlier day are dropped, as are ones scored on an earlier day unless the
+        archive mode is "reuse". Scores of the same day are always reused, so a
+        retried or re-run client gets its candidates back without new LLM calls.
+        """
+        today = archive_date(recommendation_date)
+        to_score, reused = [], []
+        n_recommended, n_scored = 0, 0
+        for candidate in passage_candidates:
+            entry = archived.get(candidate.publication.hash or candidate.publication.publication_id) or {}
+            if entry.get("recommended_date") and entry["recommended_date"] < today:
+                n_recommended += 1
+            elif entry.get("precision_best_passage") is None:
+                to_score.append(candidate)
+            elif entry["scored_date"] == today or settings.recommendation_archive_mode == "reuse":
+                candidate.publication.metadata = (candidate.publication.metadata or {})
+                candidate.publication.metadata["precision_best_passage"] = entry["precision_best_passage"]
+                reused.append(candidate)
+            else:
+                n_scored += 1
+
+        if len(to_score) < len(passage_candidates):
+            n_passages = sum(len(candidate.passages) for candidate in passage_candidates) - sum(len(candidate.passages) for candidate in to_score)
+            logger.info(f"[{client_profile.company_name}] Archive dropped {n_recommended} already recommended and "
+                        f"{n_scored} already scored publications, reused {len(reused)} scores, {n_passages} passages not re-scored")
+        return to_score, reused
+
+    @staticmethod
+    def _archive_scores(client_profile: ClientProfile, scored_candidates: List[Candidate], recommendation_date):
+        archive = get_recommendation_archive()
+        if archive is None:
+            return
+        scores = []
+        for candidate in scored_candidates:
+            best_passage = (candidate.publication.metadata or {}).get("precision_best_passage")
+            publication_hash = candidate.publication.hash or candidate.publication.publication_id
+            if publication_hash and is_scored_precision_result(best_passage):
+                scores.append((publication_hash, best_passage))
+        archive.record_scores(client_profile.client_id, scores, recommendation_date)
+
+    @staticmethod
+    def _recommended_publications(publications: List[Publication], recommendations) -> List[Publication]:
+        """
+        The publications that made it into the output of recsys_llm, which has one
+        row per publication in order: the ones with a positive weighted average
+        score. Rows scored 0, including failed LLM calls, are not recommended.
+        """
+        if not isinstance(recommendations, pd.DataFrame) or len(recommendations) != len(publications) \
+                or "weighted average score" not in recommendations:
+            return []
+        scores = pd.to_numeric(recommendations["weighted average score"], errors="coerce").fillna(0)
+        return [publication for publication, score in zip(publications, scores) if score > 0]
+
+    @staticmethod
+    def _archive_recommendations(client_profile: ClientProfile, publications: List[Publication], recommendation_date):
+        archive = get_recommendation_archive()
+        if archive is None:
+            return
+        archive.record_recommended(client_profile.client_id,
+                                [publication.hash or publication.publication_id for publication in publications
+                                 if publication.hash or publication.publication_id],
+                                recommendation_date)
+
+    @staticmethod
+    def _flush_chat_index():
+        """Persist the chat messages embedded for this client; a failed save only costs re-embedding them"""
+        try:
+            get_chat_embedding_index().flush()
+        except Exception as e:
+            logger.error(f"[ChatEmbeddingIndex] Error saving chat embeddings: {e}")
+
+    @staticmethod
+    def _collect_candidates(passage_candidates: List[Candidate], hash_archive: set) -> List[Publication]:
+        candidates = []
+        seen_hashes = set()
+        for cand in passage_candidates:
+            doc_hash = cand.publication.hash or cand.publication.publication_id
+            if not doc_hash:
+                continue
+            if doc_hash in seen_hashes or doc_hash in hash_archive:
+                continue
+            seen_hashes.add(doc_hash)
+            candidates.append(cand.publication)
+
+        return candidates
+
+    def _generate_candidates(self, client_profile: ClientProfile, recommendation_date: int) -> List[Publication]:
+        recommendation_date = recommendation_date or self.recommendation_date
+
+        # publications scored for or sent to this client by earlier runs
+        archived = self._archived_entries(client_profile, recommendation_date)
+        hash_archive = {publication_hash for publication_hash, entry in archived.items()
+                        if entry["recommended_date"] and entry["recommended_date"] < archive_date(recommendation_date)}
+
+        query_generation_requests = self._query_generation_requests(client_profile)
+
         with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = {
-                executor.submit(call_llm_query_chat_interest_template): "chat_interest",
-                executor.submit(call_llm_query_chat_summary_template): "chat_summary",
-                executor.submit(call_llm_query_chat_products_template): "chat_products",
-                executor.submit(call_llm_query_chat_currencies_template): "chat_currencies",
-            }
+            futures = {executor.submit(partial(call_structured_llm, **request)): key
+                       for key, request in query_generation_requests.items()}
 
             results = {"chat_interest": [], "chat_summary": [], "chat_products": [], "chat_currencies": []}
             for future in as_completed(futures):
                 key = futures[future]
                 try:
                     resp = future.result()
-                    queries = _post_process_query_generation_result(resp)
+                    queries = self._post_process_query_generation_result(resp)
                     results[key] = queries
                 except Exception as e:
                     logger.error(f"Error occurred while processing {key}: {e}")
@@ -106,48 +279,59 @@ class Market360Recsys:
         )
 
         # get most relevant publications during recall stage
-        retrieved_docs = []
-        for query in queries:
-            docs = recsys_rag(
-                query,
-                embedding_folder_path=settings.embedding_folder_path,
-                publication_file_path=settings.publication_file_path,
-                top_k=20,
-            )
-            retrieved_docs.extend(docs)
+        retrieved_hits = recsys_rag_batch(
+            queries,
+            embedding_folder_path=settings.embedding_folder_path,
+            publication_file_path=settings.publication_file_path,
+            top_k=20,
+            recommendation_date=recommendation_date,
+        )
 
         # Build passage-aware candidates and then reduce to publications while preserving best passages
-        passage_candidates = build_candidates_with_passages(query=" ".join(queries), documents=retrieved_docs, max_passages_per_pub=3)
+        passage_candidates, reused_candidates = self._build_passage_candidates(client_profile, queries, retrieved_hits,
+                                                                               archived, recommendation_date)
 
         # Optional: attach a simple precision signal per publication using passage precision scoring
-        for cand in passage_candidates:
-            precision_results = score_passages_precision(client_profile, cand)
-            # select best passage by score then relation_confidence
-            try:
-                best = sorted(
-                    precision_results,
-                    key=lambda r: (int(r.get("score", 0)), float(r.get("relation_confidence", 0.0))),
-                    reverse=True,
-                )[0]
-            except Exception:
-                best = {"score": 0, "relation_confidence": 0.0}
-            cand.publication.metadata = (cand.publication.metadata or {})
-            cand.publication.metadata.update({
-                "precision_best_passage": best,
-            })
+        passage_candidates = score_candidates_precision(client_profile, passage_candidates)
+        self._archive_scores(client_profile, passage_candidates, recommendation_date)
 
-        candidates = []
-        seen_hashes = set()
-        for cand in passage_candidates:
-            doc_hash = cand.publication.hash or cand.publication.publication_id
-            if not doc_hash:
-                continue
-            if doc_hash in seen_hashes or doc_hash in hash_archive:
+        return self._collect_candidates(passage_candidates + reused_candidates, hash_archive)
+
+    async def _agenerate_candidates(self, client_profile: ClientProfile, recommendation_date: int) -> List[Publication]:
+        recommendation_date = recommendation_date or self.recommendation_date
+
+        # publications scored for or sent to this client by earlier runs
+        archived = self._archived_entries(client_profile, recommendation_date)
+        hash_archive = {publication_hash for publication_hash, entry in archived.items()
+                        if entry["recommended_date"] and entry["recommended_date"] < archive_date(recommendation_date)}
+
+        query_generation_requests = self._query_generation_requests(client_profile)
+        responses = await asyncio.gather(*[acall_structured_llm(**request) for request in query_generation_requests.values()],
+                                         return_exceptions=True)
+
+        queries = []
+        for key, resp in zip(query_generation_requests, responses):
+            if isinstance(resp, Exception):
+                logger.error(f"Error occurred while processing {key}: {resp}")
                 continue
-            seen_hashes.add(doc_hash)
-            candidates.append(cand.publication)
+            queries.extend(self._post_process_query_generation_result(resp))
 
-        return candidates
+        # get most relevant publications during recall stage
+        retrieved_hits = await arecsys_rag_batch(
+            queries,
+            embedding_folder_path=settings.embedding_folder_path,
+            publication_file_path=settings.publication_file_path,
+            top_k=20,
+            recommendation_date=recommendation_date,
+        )
+
+        passage_candidates, reused_candidates = self._build_passage_candidates(client_profile, queries, retrieved_hits,
+                                                                               archived, recommendation_date)
+
+        passage_candidates = await ascore_candidates_precision(client_profile, passage_candidates)
+        self._archive_scores(client_profile, passage_candidates, recommendation_date)
+
+        return self._collect_candidates(passage_candidates + reused_candidates, hash_archive)
 
     def _filter_and_rerank_by_precision(self,
                                         client_profile: ClientProfile,
@@ -160,51 +344,29 @@ class Market360Recsys:
         min_confidence = settings.precision_min_confidence if min_confidence is None else min_confidence
         top_n = settings.precision_top_k if top_n is None else top_n
 
-        def _extract_precision_tuple(pub: Publication):
-            meta = pub.metadata or {}
-            best = meta.get("precision_best_passage", {}) or {}
-            try:
-                score = int(best.get("score", 0))
-            except Exception:
-                score = 0
-            try:
-                confidence = float(best.get("relation_confidence", 0.0))
-            except Exception:
-                confidence = 0.0
-            relation_match = bool(best.get("relation_match", False))
-            return relation_match, score, confidence
-
-        # Filter by thresholds
-        filtered = []
-        for pub in publications:
-            relation_match, score, confidence = _extract_precision_tuple(pub)
-            if relation_match and score >= min_score and confidence >= min_confidence:
-                filtered.append((pub, score, confidence))
-
-        # Sort by precision score then confidence desc
-        filtered.sort(key=lambda x: (x[1], x[2]), reverse=True)
-
-        # Trim to top_n
-        top_filtered = [p for p, _, _ in (filtered[:top_n] if top_n else filtered)]
-
-        return top_filtered
+        precision_table = build_precision_table(publications)
+        top_indices = select_top_precision(precision_table, min_score, min_confidence, top_n)
+
+        return [publications[i] for i in top_indices]
 
     def recommend(self, 
                   client: ClientInput,
-                  recommendation_date : Optional[int] = settings.bbg_chat_coverage_day_range,
+                  recommendation_date : Optional[int] = None,
                   bbg_chat_coverage_day_range : Optional[int] = settings.bbg_chat_coverage_day_range):
         
         recommendation_date = recommendation_date or self.recommendation_date
 
-        raw_bbg_chat_df = self._prepare_bbg_chat_data()
+        raw_bbg_chat_df = self._prepare_bbg_chat_data(client, recommendation_date, bbg_chat_coverage_day_range)
 
         client_profile = defaultdict()
+        client_profile["client_id"]    = archive_client_id(client)
         client_profile["country"]      = ""
         client_profile["company_name"] = client.company
         client_profile["sector"]       = ""
 
         client_profile = chat_feature_extraction(client_profile=client_profile,
                                                  chat_history_df=raw_bbg_chat_df)
+        self._flush_chat_index()
 
         client_profile = ClientProfile(**client_profile)
 
@@ -219,6 +381,50 @@ class Market360Recsys:
         # Stage 3: Final LLM relevance scoring on precision-filtered set
         recommendations = recsys_llm(client_profile=client_profile,
                                      candidates=precision_candidates)
+        self._archive_recommendations(client_profile,
+                                      self._recommended_publications(precision_candidates, recommendations),
+                                      recommendation_date)
+
+        return recommendations
+
+    async def arecommend(self,
+                         client: ClientInput,
+                         recommendation_date : Optional[int] = None,
+                         bbg_chat_coverage_day_range : Optional[int] = settings.bbg_chat_coverage_day_range):
+        """
+        Async variant of recommend. Every LLM and embedding request goes through
+        ainvoke and shares the global limiter, so one event loop can serve many clients.
+        """
+        recommendation_date = recommendation_date or self.recommendation_date
+
+        raw_bbg_chat_df = await asyncio.to_thread(self._prepare_bbg_chat_data, client, recommendation_date, bbg_chat_coverage_day_range)
+
+        client_profile = defaultdict()
+        client_profile["client_id"]    = archive_client_id(client)
+        client_profile["country"]      = ""
+        client_profile["company_name"] = client.company
+        client_profile["sector"]       = ""
+
+        client_profile = await achat_feature_extraction(client_profile=client_profile,
+                                                        chat_history_df=raw_bbg_chat_df)
+        await asyncio.to_thread(self._flush_chat_index)
+
+        client_profile = ClientProfile(**client_profile)
+
+        # Stage 1: Recall
+        candidates = await self._agenerate_candidates(client_profile=client_profile,
+                                                      recommendation_date=recommendation_date)
+
+        # Stage 2: Precision filter & rerank (aboutness + relation confidence)
+        precision_candidates = self._filter_and_rerank_by_precision(client_profile=client_profile,
+                                                                    publications=candidates)
+
+        # Stage 3: Final LLM relevance scoring on precision-filtered set
+        recommendations = await arecsys_llm(client_profile=client_profile,
+                                            candidates=precision_candidates)
+        self._archive_recommendations(client_profile,
+                                      self._recommended_publications(precision_candidates, recommendations),
+                                      recommendation_date)
 
         return recommendations
 
@@ -1,3 +1,4 @@
+from typing import List
 from pydantic_settings import BaseSettings
 
 
@@ -7,8 +8,22 @@ class Settings(BaseSettings):
 
     max_worker: int = 10
 
+    llm_http_max_connections: int = 20
+    llm_max_requests_per_second: float = 20
+    llm_max_concurrency: int = 16
+    llm_max_requests_per_run: int = 0
+
+    # LLM response cache
+    llm_cache_enabled       : bool = True
+    llm_cache_path          : str = "data/cache/llm_responses.sqlite"
+    llm_cache_ttl_seconds   : int = 7 * 24 * 60 * 60
+    llm_cache_max_bytes     : int = 512 * 1024 * 1024
+
+    schedule_region     : str = "ASIA"
+
     clients_file_path   : str = "clients.yaml"
     bbg_chat_file_path  : str = "data/bbg_chat.csv"
+    bbg_chat_dataset_path : str = "data/bbg_chat_parquet"
 
     bbg_chat_coverage_day_range : int = 30
     rfq_coverage_day_range      : int = 30
@@ -34,17 +49,68 @@ class Settings(BaseSettings):
     azure_openai_embeddings_model_name      : str = "text-embedding-3-small"
 
 
+    # Embedding service (content-hash vector cache and request coalescing)
+    embedding_cache_enabled             : bool = True
+    embedding_cache_path                : str = "data/cache/embeddings"
+    embedding_batch_size                : int = 256
+    embedding_batch_wait_ms             : int = 20
+    embedding_max_concurrent_batches    : int = 4
+
     # Embeddings
-    embedding_folder_path : str = "data/embeddings"
-    publication_file_path : str = "data/publications.json"
+    embedding_folder_path       : str = "data/embeddings"
+    chat_embedding_folder_path  : str = "data/chat_embeddings"
+    publication_file_path       : str = "data/publications.json"
+
+    # Publication FAISS index (faiss.index_factory string, e.g. "Flat", "IVF1024,Flat", "IVF1024,PQ64",
+    # "HNSW32", "SQ8" or "SQfp16"), trained on up to `max_training_points` indexed vectors
+    publication_index_factory               : str = "Flat"
+    publication_index_max_training_points   : int = 100000
+    publication_index_nprobe                : int = 16
+    publication_index_ef_search             : int = 64
+
+    # Publication feature extraction ("separate": one prompt per field, "combined": one structured call)
+    publication_extraction_mode            : str = "separate"
+    publication_extraction_checkpoint_path : str = "data/cache/publication_extraction.jsonl"
 
     # Publication chunk
-    publication_chunk_size      : int = 1000
-    publication_chunk_overlap   : int = 100
+    publication_chunk_size          : int = 1000
+    publication_chunk_overlap       : int = 100
+    publication_ingest_batch_size   : int = 256
 
     # Recsys
     output_file_path : str = "results/recsys_output_{date}.csv"
 
+    # Pipeline scheduler
+    pipeline_max_concurrent_clients : int = 4
+    pipeline_client_timeout_seconds : int = 30 * 60
+    pipeline_max_retries            : int = 1
+    run_summary_file_path           : str = "results/run_summary_{date}.csv"
+
+    # Hybrid recall: weights of the dense (FAISS) and BM25 scores, 0 BM25 weight disables BM25
+    hybrid_dense_weight     : float = 0.7
+    hybrid_bm25_weight      : float = 0.3
+
+    # Retrieval metadata filter: publications published in the `lookback_days` days up to the
+    # recommendation date (0 disables) and, when set, tagged with one of these regions / asset classes
+    retrieval_lookback_days : int = 30
+    retrieval_regions       : List[str] = []
+    retrieval_asset_classes : List[str] = []
+
+    # Recall fusion ("rrf": reciprocal rank fusion, "max": best relevance score across queries)
+    retrieval_fusion_method : str = "rrf"
+    retrieval_rrf_k         : int = 60
+    candidate_pool_size     : int = 50
+
+    # Lexical prefilter before precision scoring ("demote", "drop" or "off")
+    lexical_prefilter_mode  : str = "demote"
+
+    # Cross-run archive of the publications scored for / recommended to each client. Already
+    # recommended ones are dropped before precision scoring; previously scored ones are dropped
+    # ("skip") or keep their archived precision score ("reuse"); "off" disables the archive
+    recommendation_archive_mode      : str = "skip"
+    recommendation_archive_path      : str = "data/cache/recommendation_archive.sqlite"
+    recommendation_archive_day_range : int = 30
+
     # Precision filtering
     precision_min_score: int = 5
     precision_min_confidence: float = 0.5
@@ -1,4 +1,6 @@
+import time
 import yaml
+import threading
 from loguru import logger
 
 
@@ -15,4 +17,23 @@ def load_yaml_file(file_path: str):
             return yaml.load(file, Loader=yaml.FullLoader)
     except Exception as e:
         logger.error(f"Error loading yaml file: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls to at most `max_per_second` (0 disables it)."""
+
+    def __init__(self, max_per_second: float):
+        self.interval = 1.0 / max_per_second if max_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)